@@ -1,10 +1,47 @@
 #created by L. Ruijg, R. Silfhout and F. Gerken
 
 import math
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
-from matplotlib.backends.backend_pdf import PdfPages
-import numpy as np
+import array
+import collections
+import contextlib
+import fractions
+import importlib
+import operator
+import os
+import re
+import struct
+import sys
+import threading
+import time
+import types
+import weakref
+
+class _LazyModule():
+    """A module that is only imported when one of its attributes is used"""
+    def __init__(self, name, needed_for):
+        self._name = name
+        self._needed_for = needed_for
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            try:
+                self._module = importlib.import_module(self._name)
+            except ImportError as error:
+                raise ImportError('%s is needed for %s: %s' % (self._name, self._needed_for, error))
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+# NumPy and matplotlib are imported on first use: parsing, simplifying, differentiating and
+# evaluating with numbers work without them, so the module can be used where they aren't installed
+np = _LazyModule('numpy', 'evaluate_batch, vectorized compile and graph')
+plt = _LazyModule('matplotlib.pyplot', 'graph')
+
+# whether value is a NumPy array, without importing NumPy when nothing else did
+def _is_array(value):
+    return 'numpy' in sys.modules and isinstance(value, sys.modules['numpy'].ndarray)
 
 # split a string into mathematical tokens
 # returns a list of numbers, operators, parantheses and commas
@@ -33,6 +70,44 @@ def tokenize(string):
     return ans
     
    
+# regular expression for a single token, the name of the group that matches is the kind of the token
+_TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+      | (?P<name>[A-Za-z_][A-Za-z_0-9]*)
+      | (?P<operator>\*\*|[-+*/])
+      | (?P<lparen>\()
+      | (?P<rparen>\))
+      | (?P<comma>,)
+    )""", re.VERBOSE)
+
+# split a string into typed tokens in a single pass
+# returns a list of (kind, value) pairs, numbers are already converted to int or float
+def scan(string):
+    tokens = []
+    position = 0
+    end = len(string.rstrip())
+    while position < end:
+        match = _TOKEN_PATTERN.match(string, position)
+        if match is None:
+            raise ValueError('Unknown token: %s' % string[position:].split()[0])
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == 'number':
+            if '.' in text or 'e' in text or 'E' in text:
+                tokens.append((kind, float(text)))
+            else:
+                tokens.append((kind, int(text)))
+        else:
+            tokens.append((kind, text))
+        position = match.end()
+    return tokens
+
+# the key in parse_cache of a list of tokens from scan; numbers keep their type, as 1 and 1.0 are equal
+# but don't give the same constant
+def _token_key(tokens):
+    return tuple([(kind, type(value), value) if kind == 'number' else (kind, value) for kind, value in tokens])
+
 # check if a string represents a numeric value
 def isnumber(string):
     try:
@@ -51,14 +126,889 @@ def isint(string):
 
 
 
-class Expression():
+class LRUCache():
+    """A size-bounded cache that evicts the least recently used entry, safe to share between threads"""
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    # returns default when the key is not in the cache
+    def get(self, key, default=None):
+        if self.maxsize <= 0:
+            return default
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            self._evict()
+
+    # change the maximum number of entries, a maxsize of 0 switches the cache off
+    def resize(self, maxsize):
+        with self.lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def _evict(self):
+        while len(self.entries) > max(self.maxsize, 0):
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'maxsize': self.maxsize, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+
+class NodeTable():
+    """A table of interned expression nodes, shared by all nodes built while it is active"""
+    def __init__(self):
+        # nodes are only kept alive by the expressions using them
+        self.nodes = weakref.WeakValueDictionary()
+        # id of every node in the table -> weak reference to it, to tell a node of the table from an equal tree
+        # built outside of it; the entry is removed with the node
+        self.members = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.nodes)
+
+    # the node of class cls with the constructor arguments args and kwargs: the one in the table, or a new
+    # one that is added to it. Only a new node is initialised, with the interned forms of the children in
+    # args, so the children of a node in the table are in the table themselves and never change
+    def build(self, cls, args, kwargs):
+        key = _node_key(cls, args, kwargs)
+        try:
+            node = self.nodes.get(key)
+        except TypeError:
+            # unhashable arguments (e.g. an array as value) can't be interned
+            node = _new_node(cls)
+            node.__init__(*args, **kwargs)
+            return node
+        if node is not None:
+            self.hits += 1
+            return node
+        self.misses += 1
+        interned = tuple([self.intern(a) if isinstance(a, Expression) else a for a in args])
+        if any(a is not b for a, b in zip(interned, args)):
+            key = _node_key(cls, interned, kwargs)
+        node = _new_node(cls)
+        node.__init__(*interned, **kwargs)
+        self.nodes[key] = node
+        self.members[id(node)] = weakref.KeyedRef(node, self._forget, id(node))
+        return node
+
+    def _forget(self, reference):
+        self.members.pop(reference.key, None)
+
+    # expression itself when it is a node of the table, otherwise the equal tree of nodes of the table;
+    # only the parts of the tree that aren't in the table are rebuilt
+    def intern(self, expression):
+        if self.member(expression):
+            return expression
+        with interning(self):
+            return postorder(expression, lambda node, children: node.rebuild(children),
+                             lambda node: node if self.member(node) else None)
+
+    def member(self, node):
+        reference = self.members.get(id(node))
+        return reference is not None and reference() is node
+
+# the key of a node in a NodeTable: the class and the constructor arguments. Children are compared in the
+# dictionary by their cached hashes, and by identity when they are interned
+def _node_key(cls, args, kwargs):
+    key = (cls,) + tuple([a if isinstance(a, Expression) else (type(a), a) for a in args])
+    if kwargs:
+        key += tuple(sorted(kwargs.items()))
+    return key
+
+# the class of the node classes, it builds the nodes: with interning switched on through the node table
+class _NodeClass(type):
+    def __call__(cls, *args, **kwargs):
+        if _node_table is None:
+            node = _new_node(cls)
+            node.__init__(*args, **kwargs)
+            return node
+        return _node_table.build(cls, args, kwargs)
+
+# a new, uninitialized node of class cls, with empty caches
+def _new_node(cls):
+    profile = getattr(_profiling, 'profile', None)
+    if profile is not None:
+        profile.allocations[cls.__name__] += 1
+    node = object.__new__(cls)
+    node._hash = None
+    node._free = None
+    return node
+
+# the active NodeTable, None when interning is switched off
+_node_table = None
+
+# switch interning on for all nodes built inside the with-block:
+#     with interning() as table:
+#         e = Expression.fromString('x*x+x*x')
+# structurally identical subtrees are then the same object, so comparing them is a single identity check
+@contextlib.contextmanager
+def interning(table=None):
+    global _node_table
+    previous = _node_table
+    if table is None:
+        table = previous if previous is not None else NodeTable()
+    _node_table = table
+    try:
+        yield table
+    finally:
+        _node_table = previous
+
+# rebuild an existing expression tree through a NodeTable, returns the interned tree
+def intern(expression, table=None):
+    with interning(table) as table:
+        return table.intern(expression)
+
+
+class Profile():
+    """Counts and timings of the rewrite and evaluation engines, collected by profiling()"""
+    def __init__(self):
+        # (code, line of the return statement) of every rule that fired, with its count and time
+        # (of the rule itself, the Simplifier simplifies the tree it returns afterwards)
+        self.rules = {}
+        # number of nodes created, per class
+        self.allocations = collections.Counter()
+        # number of subtrees simplified at each nesting depth: 1 for the expression itself, one more for
+        # every rewrite or trial combination of like terms it happens in
+        self.depths = collections.Counter()
+        # number of calls of each of _EVALUATION_FUNCTIONS
+        self.evaluations = collections.Counter()
+        self.elapsed = 0.0
+        self._started = []
+
+    # the function given to sys.setprofile, called for every call and return of a Python function
+    def _event(self, frame, event, arg):
+        if event == 'call':
+            name = frame.f_code.co_name
+            if name in _RULE_FUNCTIONS:
+                self._started.append(time.perf_counter())
+            elif name in _EVALUATION_FUNCTIONS:
+                self.evaluations[name] += 1
+        elif event == 'return':
+            name = frame.f_code.co_name
+            if name in _RULE_FUNCTIONS and self._started:
+                elapsed = time.perf_counter() - self._started.pop()
+                rule = self.rules.setdefault((frame.f_code, frame.f_lineno), [0, 0.0])
+                rule[0] += 1
+                rule[1] += elapsed
+
+    # the collected numbers as a dictionary of plain values; every rule is named after the function and
+    # line of its return statement, and described by the comment above its branch (like '# ex: x+x=2*x')
+    def stats(self):
+        rules = {}
+        for (code, line), (count, elapsed) in self.rules.items():
+            name = '%s:%d' % (getattr(code, 'co_qualname', code.co_name), line)
+            rules[name] = {'count': count, 'time': elapsed, 'rule': _rule_comment(code, line)}
+        return {'time': self.elapsed, 'rules': rules, 'allocations': dict(self.allocations),
+                'depths': dict((str(depth), count) for depth, count in sorted(self.depths.items())),
+                'evaluations': dict(self.evaluations)}
+
+    # the stats as JSON, written to file (a path or an open file) when it is given
+    def to_json(self, file=None):
+        import json
+        text = json.dumps(self.stats(), indent=2, sort_keys=True)
+        if file is None:
+            return text
+        if isinstance(file, str):
+            with open(file, 'w') as output:
+                output.write(text)
+        else:
+            file.write(text)
+        return text
+
+# the functions holding the rewrite rules, and the evaluation functions whose calls are counted
+_RULE_FUNCTIONS = frozenset(['simplify_specific', 'simplify_step'])
+_EVALUATION_FUNCTIONS = frozenset(['evaluate', 'evaluate_step', 'numeric_value', 'evaluate_batch',
+                                   'batch_value', 'compile', 'derivative_specific',
+                                   'value_and_gradient', 'dual_value', 'newton', 'find_root', 'integrate'])
+
+# the Profile collecting counts in each thread, in its attribute profile; missing when profiling is switched
+# off in the thread (then the only cost is one lookup per new node)
+_profiling = threading.local()
+
+# collect a Profile of everything done in the block in this thread, e.g.
+#     with profiling() as profile:
+#         expression.simplify()
+#     print(profile.to_json())
+@contextlib.contextmanager
+def profiling(profile=None):
+    if profile is None:
+        profile = Profile()
+    previous, previous_hook = getattr(_profiling, 'profile', None), sys.getprofile()
+    _profiling.profile = profile
+    start = time.perf_counter()
+    sys.setprofile(profile._event)
+    try:
+        yield profile
+    finally:
+        sys.setprofile(previous_hook)
+        profile.elapsed += time.perf_counter() - start
+        _profiling.profile = previous
+
+# the comment above the branch that ends in the return statement at line of code, '' when there is none
+def _rule_comment(code, line):
+    import linecache
+    for number in range(line - 1, code.co_firstlineno, -1):
+        text = linecache.getline(code.co_filename, number).strip()
+        if text.startswith('#'):
+            return text.lstrip('#').strip()
+        if text.startswith(('if ', 'elif ', 'else')):
+            above = linecache.getline(code.co_filename, number - 1).strip()
+            if above.startswith('#'):
+                return above.lstrip('#').strip()
+            # the last branch of the rules of a node
+            return 'no rule applies' if text.startswith('else') else ''
+    return ''
+
+# walk the tree in post-order with an explicit stack instead of recursion, so trees of any depth
+# can be handled. visit(node, results) gets the results of the children of node (in order) and
+# returns the result for node. known(node) may return a result for a node beforehand, its subtree
+# is then skipped; it returns None for nodes that have to be visited.
+def postorder(expression, visit, known=None):
+    results = []
+    stack = [(expression, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            count = len(node.children())
+            operands = results[len(results) - count:]
+            del results[len(results) - count:]
+            results.append(visit(node, operands))
+            continue
+        if known is not None:
+            result = known(node)
+            if result is not None:
+                results.append(result)
+                continue
+        children = node.children()
+        if children:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(children))
+        else:
+            results.append(visit(node, []))
+    return results[0]
+
+# visit functions for postorder that fill the caches of a node
+def _set_hash(node, child_hashes):
+    if node._hash is None:
+        if child_hashes:
+            node._hash = hash((type(node), str(node.op_symbol)) + tuple(child_hashes))
+        else:
+            hash(node)
+    return node._hash
+
+# the free variables of a tree in one walk; only subtrees with a cached set are skipped. The set is not
+# cached on every subtree, in a long sum of distinct variables those sets would take quadratic memory
+def _collect_free_variables(expression):
+    free = set()
+    stack = [expression]
+    while stack:
+        node = stack.pop()
+        if node._free is not None:
+            free.update(node._free)
+        elif node.children():
+            stack.extend(node.children())
+        else:
+            free.update(node.free_variables())
+    return frozenset(free)
+
+# the subtrees of a tree whose variables all have a value in dictionary, as a table from subtree to
+# True or False, filled in one walk
+def _bound_subtrees(expression, dictionary):
+    table = {}
+    def visit(node, children):
+        result = all(children) if children else all(name in dictionary for name in node.free_variables())
+        table[node] = result
+        return result
+    postorder(expression, visit, table.get)
+    return table
+
+# tree-equality without recursion; with exact=True Constants are only equal when their values have
+# the same type as well, so 1 and 1.0 differ
+def _structurally_equal(expression, other, exact=False):
+    pairs = [(expression, other)]
+    while pairs:
+        node, other = pairs.pop()
+        if node is other:
+            continue
+        if type(node) != type(other) or hash(node) != hash(other):
+            return False
+        children = node.children()
+        if not children:
+            if node != other or (exact and type(node) == Constant and type(node.value) != type(other.value)):
+                return False
+        elif node.op_symbol != other.op_symbol:
+            return False
+        else:
+            pairs.extend(zip(children, other.children()))
+    return True
+
+# the string representation of a tree, written piece by piece into a single list
+def _infix(expression):
+    return ''.join(_emit(expression, 'infix'))
+
+# the pieces of the text of a tree in one of the _EMIT_TARGETS, in order and without recursion.
+# Every node gives its pieces as strings and subtrees, the subtrees are expanded in turn;
+# only the pieces of the nodes on the current path are kept, not the text written so far
+def _emit(expression, target):
+    parts, leaf = _EMIT_TARGETS[target]
+    stack = [expression]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            yield item
+        elif item.children():
+            stack.extend(reversed(parts(item)))
+        else:
+            yield leaf(item)
+
+# write the pieces of _emit to file in chunks of about chunksize characters
+def _emit_to(expression, target, file, chunksize=65536):
+    chunk = []
+    size = 0
+    for piece in _emit(expression, target):
+        chunk.append(piece)
+        size += len(piece)
+        if size >= chunksize:
+            file.write(''.join(chunk))
+            chunk = []
+            size = 0
+    file.write(''.join(chunk))
+
+# the precedence of a node as written by latex_parts: a fraction or function is a single block
+def _latex_precedence(node):
+    if type(node) == DivNode or (isinstance(node, UnaryNode) and type(node) != NegNode):
+        return 6
+    elif type(node) == Constant and isinstance(node.value, fractions.Fraction) and node.value.denominator != 1:
+        return 6 if node.value > 0 else 3
+    return node.precedence
+
+# Python source of a node: the infix text, with the functions taken from module (math or np)
+def _python_parts(node, module):
+    if type(node) == FunctionNode:
+        raise ValueError('Unknown function %s can not be compiled' % node.op_symbol)
+    elif isinstance(node, UnaryNode) and node.op_symbol in ['sin', 'cos', 'tan', 'log']:
+        return ['%s.%s(' % (module, node.op_symbol), node.operand, ')']
+    return node.infix_parts()
+
+def _python_leaf(node):
+    if isinstance(node, Constant) and isinstance(node.value, float) and not math.isfinite(node.value):
+        return "float('%r')" % node.value
+    return str(node)
+
+
+class _ExactKey():
+    """Key of a tree in the memo tables of exact simplification, telling apart Constants such as 1 and 1.0"""
+    __slots__ = ('node',)
+
+    def __init__(self, node):
+        self.node = node
+
+    def __eq__(self, other):
+        return _structurally_equal(self.node, other.node, exact=True)
+
+    def __hash__(self):
+        return hash(self.node)
+
+
+class Simplifier():
+    """Memoized rewrite engine behind Expression.simplify
+
+    Every distinct subtree is simplified only once: first its children, then the
+    rules of its simplify_step, and the result again until it no longer changes.
+    The rules return the trees they rewrite to instead of simplifying them, the
+    engine keeps all pending simplifications on a worklist of its own, so neither
+    deep trees nor long chains of rewrites run into the recursion limit. Like terms
+    of sums and products are found by collect, through an index of the terms of
+    every simplified sum or product.
+    """
+    _local = threading.local()
+
+    # with exact=True constants are folded with exact rational arithmetic, see _fold
+    def __init__(self, exact=False):
+        self.exact = exact
+        # maps every subtree seen so far onto its simplified form
+        self.memo = {}
+        # number of subtrees simplified, and number of subtrees found in the memo table
+        self.visited = 0
+        self.hits = 0
+        # maps a simplified sum or product onto the keys (see _spine_key) of its terms, each with
+        # the first term (and its sign) having that key; handed on to the sum or product built on top of it
+        self.spines = {}
+        # number of rewrites (and trial combinations of collect) the running simplification is nested in
+        self.depth = 0
+
+    # the engine that is currently simplifying in this thread, if any
+    def active():
+        return getattr(Simplifier._local, 'engine', None)
+
+    def simplify(self, expression):
+        previous = Simplifier.active()
+        Simplifier._local.engine = self
+        try:
+            return self._run(expression)
+        finally:
+            Simplifier._local.engine = previous
+
+    # the worklist: a stack of pending simplifications, each a generator (see _task) that yields the
+    # trees it needs simplified and is sent their simplified forms back; the last one on the stack runs
+    def _run(self, expression):
+        result = self._known(expression)
+        if result is not None:
+            return result
+        depth = self.depth
+        self.depth += 1
+        stack = [self._task(expression)]
+        try:
+            while stack:
+                try:
+                    tree = stack[-1].send(result)
+                except StopIteration as stop:
+                    stack.pop()
+                    result = stop.value
+                    continue
+                result = self._known(tree)
+                if result is None:
+                    stack.append(self._task(tree))
+        finally:
+            self.depth = depth
+        return result
+
+    def _known(self, node):
+        if isinstance(node, (Constant, Variable)):
+            return node
+        result = self.memo.get(self.key(node))
+        if result is not None:
+            self.hits += 1
+            # a copy of a tree that is simplified already stands for itself, so the nodes above it keep
+            # their children and aren't rebuilt (and compared with the original all the way down)
+            if result is not node and _structurally_equal(result, node, self.exact):
+                return node
+        return result
+
+    # the key of node in the memo tables: the node itself, or in exact mode a key that also compares the
+    # types of the constants, as 1/3 + 1/3 and 1/3 + 1.0/3 are equal trees that simplify differently
+    def key(self, node):
+        return _ExactKey(node) if self.exact else node
+
+    # the simplification of node as a generator for _run: first the children, then the rules,
+    # and then the tree the rules rewrote it to
+    def _task(self, node):
+        # ex: x+(y-z)=x+y-z: the terms of a right operand that is a sum (or product) as well are added one
+        # by one, instead of simplifying that operand and taking it apart again on every level of a right-deep sum.
+        # A right operand that is simplified already is left to the rules and collect
+        written = node
+        spine = _SPINES.get(node.precedence) if isinstance(node, BinaryNode) else None
+        if spine is not None and type(node.rhs) in spine and self.key(node.rhs) not in self.memo:
+            written = _written_left_deep(node, *spine)
+        simplified = []
+        for child in written.children():
+            simplified.append((yield child))
+        self.visited += 1
+        profile = getattr(_profiling, 'profile', None)
+        if profile is not None:
+            profile.depths[self.depth] += 1
+        # while a node is being rewritten it maps onto itself, so a rule that
+        # leads back to the same tree ends the rewriting instead of looping
+        self.memo[self.key(node)] = node
+        current = written
+        if any(new is not old for new, old in zip(simplified, written.children())):
+            current = written.rebuild(simplified)
+        if current is not node:
+            self.memo.setdefault(self.key(current), current)
+        result = current.simplify_step()
+        if isinstance(result, types.GeneratorType):
+            result = yield from result
+        # keep rewriting until the fixpoint is reached
+        if result != current:
+            self.depth += 1
+            result = yield result
+            self.depth -= 1
+        self.memo[self.key(node)] = result
+        self.memo[self.key(current)] = result
+        return result
+
+    # the simplified T(left, right) of the simplified left and right, for T a sum (AddNode, SubNode) or a
+    # product (MulNode, DivNode): every term of right is combined with the term of left having the same
+    # key, if the two of them simplify to a single term. Only those pairs are tried, so a sum of n
+    # unlike terms takes O(n) work; with a combination, the sum or product is rebuilt and simplified again.
+    # node is the tree being rewritten, it is kept when nothing changes. A generator for _task, that
+    # yields the pairs of terms it tries to combine
+    def collect(self, node, T, left, right):
+        plus, minus = _SPINES[T.precedence]
+        keys = self.spines.pop(self.key(left), None) if type(left) in (plus, minus) else None
+        if keys is None:
+            keys = {}
+            for sign, term in _spine_terms(left, plus, minus, 1):
+                keys.setdefault(_spine_key(term, plus), (sign, term))
+        incoming = _spine_terms(right, plus, minus, 1 if T == plus else -1)
+        for sign, term in incoming:
+            key = _spine_key(term, plus)
+            partner = keys.get(key)
+            if partner is not None and (yield from self._combine(partner, sign, term, plus, minus)) is not None:
+                return (yield from self._rebuild(_spine_terms(left, plus, minus, 1) + incoming, plus, minus))
+            keys.setdefault(key, (sign, term))
+        if type(right) in (plus, minus):
+            # ex: x+2*(y+z)=x+2*y+2*z, written out left-deep like the sums and products of the rules
+            # and simplified again
+            return _left_deep(left, incoming, plus, minus)
+        if type(node) == T and node.lhs is left and node.rhs is right:
+            result = node
+        else:
+            result = T(left, right)
+        self.spines[self.key(result)] = keys
+        return result
+
+    # the single term that the term with sign makes together with partner (a sign and a term), or None;
+    # the pair is simplified by yielding it to _run
+    def _combine(self, partner, sign, term, plus, minus):
+        partner_sign, partner_term = partner
+        self.depth += 1
+        combined = yield (plus if partner_sign == sign else minus)(partner_term, term)
+        self.depth -= 1
+        if type(combined) in (plus, minus):
+            return None
+        return combined
+
+    # the sum or product of the signed terms with all like terms combined, in the order of their first
+    # occurrence; the constant goes at the end of a sum and at the front of a product, or at the end
+    # when it divides. A generator like collect
+    def _rebuild(self, terms, plus, minus):
+        collected = []
+        positions = {}
+        constant = None
+        for sign, term in terms:
+            key = _spine_key(term, plus)
+            if key is _CONSTANT_KEY:
+                if constant is None:
+                    constant = (sign, term)
+                else:
+                    combined = yield from self._combine(constant, sign, term, plus, minus)
+                    if plus == AddNode:
+                        # a sum ends in + c or - c, with c not negative
+                        value = _constant_of(combined) if constant[0] > 0 else -_constant_of(combined)
+                        constant = (1, Constant(value)) if value >= 0 else (-1, Constant(-value))
+                    else:
+                        constant = (constant[0], combined)
+                continue
+            position = positions.get(key)
+            if position is not None:
+                combined = yield from self._combine(collected[position], sign, term, plus, minus)
+                if combined is not None:
+                    collected[position] = (collected[position][0], combined)
+                    continue
+            else:
+                positions[key] = len(collected)
+            collected.append((sign, term))
+        identity = plus.identity
+        collected = [(sign, term) for sign, term in collected if term != identity]
+        if constant is not None and constant[1] != identity:
+            if plus == AddNode or constant[0] < 0:
+                collected.append(constant)
+            else:
+                collected.insert(0, constant)
+        if not collected:
+            return identity
+        sign, result = collected[0]
+        if sign < 0:
+            result = NegNode(result) if plus == AddNode else DivNode(Constant(1), result)
+        for sign, term in collected[1:]:
+            result = (plus if sign > 0 else minus)(result, term)
+        return result
+
+    def stats(self):
+        return {'visited': self.visited, 'hits': self.hits, 'size': len(self.memo)}
+
+
+class Differentiator():
+    """Memoized derivative engine behind Expression.derivative
+
+    The derivative of every distinct (subtree, variable) pair is built only once,
+    by the derivative_specific rules of the node classes, without simplifying in between.
+    Only the input and the final results are simplified, all by one shared Simplifier.
+    """
+    def __init__(self, simplifier=None):
+        if simplifier is None:
+            simplifier = Simplifier()
+        self.simplifier = simplifier
+        # maps (subtree, variable) onto the unsimplified derivative
+        self.memo = {}
+        # maps the name of a variable onto a table telling for every subtree whether it depends on it
+        self.dependence = {}
+        self.visited = 0
+        self.hits = 0
+
+    # the derivative of expression without simplification, used by the derivative_specific rules
+    def differentiate(self, expression, variable):
+        result = self._known(expression, variable)
+        if result is None:
+            # differentiate the subtrees children first, so the rules of a node
+            # find the derivatives of its children in the memo table
+            result = postorder(expression, lambda node, derivatives: self._differentiate_node(node, variable),
+                               lambda node: self._known(node, variable))
+        return result
+
+    def _known(self, node, variable):
+        # a subtree that doesn't depend on the variable has derivative 0
+        if not self.depends(node, str(variable.value)):
+            return Constant(0)
+        result = self.memo.get((self.simplifier.key(node), variable))
+        if result is not None:
+            self.hits += 1
+        return result
+
+    # whether the subtree depends on the variable called name. Found in one walk over the parts of the
+    # tree not seen before, and kept for every subtree
+    def depends(self, node, name):
+        table = self.dependence.setdefault(name, {})
+        result = table.get(node)
+        if result is None:
+            def visit(node, children):
+                result = any(children) if children else name in node.free_variables()
+                table[node] = result
+                return result
+            result = postorder(node, visit, table.get)
+        return result
+
+    def _differentiate_node(self, node, variable):
+        self.visited += 1
+        result = node.derivative_specific(variable, self)
+        self.memo[(self.simplifier.key(node), variable)] = result
+        return result
+
+    def derivative(self, expression, variable):
+        expression = self.simplifier.simplify(expression)
+        return self.simplifier.simplify(self.differentiate(expression, _as_variable(variable)))
+
+    def gradient(self, expression, variables):
+        expression = self.simplifier.simplify(expression)
+        return [self.simplifier.simplify(self.differentiate(expression, _as_variable(variable)))
+                for variable in variables]
+
+    def nth_derivative(self, expression, variable, n):
+        for i in range(n):
+            expression = self.derivative(expression, variable)
+        return expression
+
+    def stats(self):
+        return {'visited': self.visited, 'hits': self.hits, 'simplifier': self.simplifier.stats()}
+
+# derivatives may be taken with respect to a Variable or the name of one
+def _as_variable(variable):
+    if isinstance(variable, Variable):
+        return variable
+    return Variable(str(variable))
+
+
+class Expression(metaclass=_NodeClass):
     """A mathematical expression, represented as an expression tree"""
     
     """
     Any concrete subclass of Expression should have these methods:
      - __str__(): return a string representation of the Expression.
      - __eq__(other): tree-equality, check if other represents the same expression tree.
+     - __hash__(): structural hash, equal trees have equal hashes.
+     - children(): the subexpressions of the node.
+     - rebuild(children): a node of the same kind with the given subexpressions.
     """
+    # nodes have no __dict__, the attributes of a node class are listed in its __slots__;
+    # _hash caches the structural hash and _free the set of free variables, both filled on first use
+    __slots__ = ('_hash', '_free', '__weakref__')
+
+    # nodes are built by _NodeClass, this is only used by pickle and copy
+    def __new__(cls, *args, **kwargs):
+        return _new_node(cls)
+
+    def children(self):
+        return ()
+
+    def rebuild(self, children):
+        return self
+
+    # the names of the variables the expression depends on, as a frozenset
+    def free_variables(self):
+        if self._free is None:
+            self._free = _collect_free_variables(self)
+        return self._free
+
+    # simplify the expression with the memoized rewrite engine, see Simplifier
+    # a top level call looks the result up in result_cache first, when it is set
+    # with exact=True constants are folded exactly, e.g. 1/3 + 1/6 becomes the Fraction 1/2 instead of 0.5
+    def simplify(self, simplifier=None, exact=False):
+        if simplifier is None:
+            simplifier = Simplifier.active()
+            if simplifier is None:
+                operation = 'simplify exact' if exact else 'simplify'
+                return _cached_result(operation, self, None, lambda: Simplifier(exact).simplify(self))
+        return simplifier.simplify(self)
+
+    # evaluate the expression with the values for variables in dictionary,
+    # returns a Constant, or an expression when some variables have no value
+    # with exact=True integers and Fractions are divided exactly instead of giving a float
+    def evaluate(self, dictionary={}, exact=False):
+        if self.free_variables().issubset(dictionary):
+            return Constant(_numeric_value(self, dictionary, exact))
+        bound = _bound_subtrees(self, dictionary)
+        return postorder(self, lambda node, operands: node.evaluate_step(operands, dictionary),
+                         lambda node: _evaluate_bound(node, dictionary, exact, bound))
+
+    def evaluate_step(self, operands, dictionary):
+        return self.evaluate(dictionary)
+
+    # the derivative with respect to variable (a Variable or its name), simplified
+    def derivative(self, variable, differentiator=None, exact=False):
+        if differentiator is None:
+            name = str(_as_variable(variable).value)
+            operation = 'derivative exact' if exact else 'derivative'
+            return _cached_result(operation, self, name,
+                                  lambda: Differentiator(Simplifier(exact)).derivative(self, variable))
+        return differentiator.derivative(self, variable)
+
+    # the derivatives with respect to each of the variables, sharing all work between them
+    def gradient(self, variables, differentiator=None):
+        if differentiator is None:
+            differentiator = Differentiator()
+        return differentiator.gradient(self, variables)
+
+    # the n-th derivative with respect to variable
+    def nth_derivative(self, variable, n, differentiator=None):
+        if differentiator is None:
+            differentiator = Differentiator()
+        return differentiator.nth_derivative(self, variable, n)
+
+    # turn the expression into a Python function of the given variables, e.g.
+    #     f = Expression.fromString('x*y+sin(x)').compile(['x', 'y'])
+    #     f(1.5, 2.0)
+    # with vectorized=True the function accepts NumPy arrays and uses np.sin, np.cos etc.
+    # compiled functions are cached, equal expressions share the same function
+    def compile(self, variables, vectorized=False):
+        variables = tuple(str(v) for v in variables)
+        key = (self, variables, vectorized)
+        function = _compile_cache.get(key)
+        if function is None:
+            function = _compile([self], variables, vectorized)
+            _compile_cache.put(key, function)
+        return function
+
+    # evaluate the expression for many bindings at once, in a single walk over the tree, e.g.
+    #     e.evaluate_batch({'x': np.linspace(0, 1, 1000), 'y': 2.0})
+    # columns maps variable names onto arrays (or lists, or scalars, which are broadcast),
+    # a structured array with one field per variable can be given as well.
+    # if some variables are not bound, the result holds the remaining expressions instead
+    def evaluate_batch(self, columns):
+        if isinstance(columns, np.ndarray) and columns.dtype.names:
+            columns = {name: columns[name] for name in columns.dtype.names}
+        columns = {str(name): np.asarray(value, dtype=float) for name, value in columns.items()}
+        result = _evaluate_batch(self, columns)
+        if isinstance(result, Expression) or result.dtype == object:
+            return result
+        return _broadcast(result, *columns.values())
+
+    # the value and the partial derivatives with respect to variables, for many bindings at once, e.g.
+    #     value, (dx, dy) = e.value_and_gradient({'x': np.linspace(0, 1, 1000), 'y': 2.0}, ['x', 'y'])
+    # computed numerically in a single walk over the tree with dual numbers (forward-mode differentiation),
+    # without building the symbolic derivatives (see gradient for those). All variables must be bound;
+    # without variables the derivatives are taken with respect to every free variable, in alphabetical order
+    def value_and_gradient(self, columns, variables=None):
+        if isinstance(columns, np.ndarray) and columns.dtype.names:
+            columns = {name: columns[name] for name in columns.dtype.names}
+        columns = {str(name): np.asarray(value, dtype=float) for name, value in columns.items()}
+        if variables is None:
+            variables = sorted(self.free_variables())
+        variables = [str(v) for v in variables]
+        duals = {}
+        for name, column in columns.items():
+            seed = None
+            if name in variables:
+                seed = tuple(1.0 if v == name else None for v in variables)
+            duals[name] = Dual(column, seed)
+        result = postorder(self, lambda node, operands: node.dual_value(operands, duals))
+        arrays = list(columns.values())
+        partials = result.partials or (None,) * len(variables)
+        return (_broadcast(result.value, *arrays),
+                [_broadcast(0.0 if d is None else d, *arrays) for d in partials])
+
+    # the roots of the expression in variable found by Newton's method, from all starting points at once, e.g.
+    #     result = Expression.fromString('x**2 - a').newton('x', np.linspace(1, 10, 1000), {'a': 2})
+    #     result.value, result.converged, result.stats()
+    # the derivative is computed once and compiled together with the expression; bindings gives the other
+    # variables, as numbers or as arrays with a value per starting point. Returns a SolverResult
+    def newton(self, variable, starts, bindings={}, tol=1e-12, maxiter=50):
+        return _newton(self, str(variable), starts, bindings, tol, maxiter)
+
+    # the root of the expression in variable between lower and upper (numbers or arrays of them), where it
+    # must change sign: Newton steps, replaced by bisection whenever they leave the interval that still
+    # holds the root, so it always converges. Points without a sign change get nan. Returns a SolverResult
+    def find_root(self, variable, lower, upper, bindings={}, tol=1e-12, maxiter=100):
+        return _find_root(self, str(variable), lower, upper, bindings, tol, maxiter)
+
+    # the integral over variable from lower to upper (numbers or arrays of them), by adaptive Gauss-Kronrod
+    # quadrature: the pieces of all integrals whose error estimate is too large are halved and evaluated
+    # together, for at most maxiter rounds. Returns a SolverResult, with the estimated errors
+    def integrate(self, variable, lower, upper, bindings={}, tol=1e-10, rtol=1e-10, maxiter=30):
+        return _integrate(self, str(variable), lower, upper, bindings, tol, rtol, maxiter)
+
+    # multiply out products and integer powers of sums and collect like terms, e.g.
+    # (x+1)**2 - x becomes x ** 2 + x + 1; subtrees that aren't polynomial (sin(x), x**y, 1/x) are kept
+    # as they are, with their operands expanded. See Polynomial
+    def expand(self):
+        return Polynomial.fromExpression(self).toExpression()
+
+    # a compact binary encoding of the expression, see _to_bytes for the format
+    def to_bytes(self):
+        return _to_bytes(self)
+
+    # the expression encoded by to_bytes, read from data at offset; data may be bytes, a bytearray,
+    # a memoryview or an mmap, and is read in place without copying it. Data that isn't a complete
+    # encoded expression raises ValueError
+    def from_bytes(data, offset=0):
+        try:
+            return _from_bytes(data, offset)
+        except (IndexError, struct.error) as error:
+            # reading past the end of the data, or a reference to a constant, symbol or node that doesn't exist
+            raise ValueError('Truncated or corrupt data') from error
+
+    # the expression as text for target: 'infix' (as str), 'python' (source using math), 'numpy' (source
+    # using np) or 'latex'. With a file the text is written to it in chunks instead of returned, so a huge
+    # expression never exists as one string, e.g.
+    #     with open('derivative.tex', 'w') as file:
+    #         e.derivative('x').emit('latex', file)
+    def emit(self, target='infix', file=None):
+        if target not in _EMIT_TARGETS:
+            raise ValueError('Unknown target %s, expected one of %s' % (target, ', '.join(sorted(_EMIT_TARGETS))))
+        if file is None:
+            return ''.join(_emit(self, target))
+        _emit_to(self, target, file)
+
     # operator overloading:
     # this allows us to perform 'arithmetic' with expressions, and obtain another expression
     def __add__(self, other):
@@ -79,8 +1029,33 @@ class Expression():
     def __neg__(self):
         return NegNode(self)
         
-    # basic Shunting-yard algorithm
+    # parse a string into an expression tree, e.g. Expression.fromString('2*x**2 + sin(x)/y')
+    # names followed by brackets are functions, other names are variables
+    # parsed trees are kept in parse_cache, so parsing a formula again is a dictionary lookup
     def fromString(string):
+        # a tree is kept under the string itself, which is found without scanning it, and under its
+        # tokens, which are the same for formulas that only differ in whitespace, e.g. 'a+b' and 'a + b'
+        key = string
+        tree = parse_cache.get(key)
+        if tree is None:
+            tokens = scan(string)
+            key = _token_key(tokens)
+            tree = parse_cache.get(key)
+            if tree is None:
+                tree = _Parser(tokens).parse()
+                parse_cache.put(key, tree)
+            parse_cache.put(string, tree)
+        if _node_table is not None and not _node_table.member(tree):
+            # keep the interned tree, so the next hit in this table doesn't walk it again
+            tree = _node_table.intern(tree)
+            parse_cache.put(string, tree)
+            if key is not string:
+                parse_cache.put(key, tree)
+        return tree
+
+    # the original Shunting-yard parser, kept as a reference for benchmark.py
+    # only handles single letter variables, use fromString instead
+    def fromStringShuntingYard(string):
         # split into tokens
         tokens = tokenize(string)
         
@@ -229,23 +1204,71 @@ class Expression():
 
 class Constant(Expression):
     """Represents a constant value"""
-    def __init__(self, value, precedence = 6, associativity='both', identity=None):
+    __slots__ = ('value',)
+    associativity = 'both'
+    identity = None
+
+    def __init__(self, value):
         self.value = value
+
+    @property
+    def precedence(self):
+        # a Fraction like 1/3 is written as a division, so it gets the precedence of a DivNode
+        if isinstance(self.value, fractions.Fraction) and self.value.denominator != 1:
+            return 2
         #if self.value is less than zero, then it's a negative number and we want precedence = 3, for a NegNode 
-        if int(self.value) < 0 : 
-            self.precedence = 3
+        elif self.value < 0:
+            return 3
         #if self.value is equal or greater than zero, give it precedence = 6
-        else: 
-            self.precedence = 6
+        else:
+            return 6
             
     def __eq__(self, other):
         if isinstance(other, Constant):
             return self.value == other.value
         else:
             return False
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash((Constant, self.value))
+        return self._hash
         
     def __str__(self):
         return str(self.value)
+
+    def latex(self):
+        value = self.value
+        if isinstance(value, fractions.Fraction) and value.denominator != 1:
+            return '%s\\frac{%d}{%d}' % ('-' if value < 0 else '', abs(value.numerator), value.denominator)
+        elif isinstance(value, float) and math.isinf(value):
+            return '\\infty' if value > 0 else '-\\infty'
+        elif isinstance(value, float) and math.isnan(value):
+            return '\\mathrm{NaN}'
+        return str(value)
+
+    def rebuild(self, children):
+        return Constant(self.value)
+
+    def free_variables(self):
+        return frozenset()
+
+    def numeric_value(self, operands, dictionary):
+        return self.value
+
+    def batch_value(self, operands, columns):
+        return np.float64(self.value)
+
+    def dual_value(self, operands, duals):
+        return Dual(np.float64(self.value))
+
+    def python_code(self, operands, namespace):
+        if type(self.value) in (int, float) and math.isfinite(self.value):
+            return repr(self.value) if self.value >= 0 else '(%r)' % self.value
+        # anything without a plain literal is passed to the compiled code by name
+        name = '_c%d' % len(namespace)
+        namespace[name] = self.value
+        return name
         
     # allow conversion to numerical values
     def __int__(self):
@@ -254,35 +1277,77 @@ class Constant(Expression):
     def __float__(self):
         return float(self.value)
         
-    def simplify(self):
+    def simplify(self, simplifier=None, exact=False):
         return self
         
-    def evaluate(self, dictionary={}):
+    def evaluate(self, dictionary={}, exact=False):
         return self
     
-    def derivative(self,variable):
+    def derivative_specific(self, variable, differentiator):
         return Constant(0)
 
         
 class Variable(Expression):
     """Represents a variable"""
-    def __init__(self, value, precedence=6, associativity='both', identity = None):
+    __slots__ = ('value',)
+    precedence = 6
+    associativity = 'both'
+    identity = None
+
+    def __init__(self, value):
         self.value = value
-        self.precedence=precedence
         
     def __str__(self):
         return str(self.value)
+
+    # a name of one letter is written as it is, a longer name upright
+    def latex(self):
+        name = str(self.value)
+        if len(name) > 1:
+            return '\\mathrm{%s}' % name.replace('_', '\\_')
+        return name
     
     def __eq__(self,other):
         if isinstance(other,Variable):
             return self.value==other.value
         else:
             return False
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash((Variable, self.value))
+        return self._hash
+
+    def rebuild(self, children):
+        return Variable(self.value)
+
+    def free_variables(self):
+        if self._free is None:
+            self._free = frozenset([str(self.value)])
+        return self._free
+
+    def numeric_value(self, operands, dictionary):
+        return dictionary[str(self.value)]
+
+    def batch_value(self, operands, columns):
+        return columns.get(str(self.value), self)
+
+    def dual_value(self, operands, duals):
+        try:
+            return duals[str(self.value)]
+        except KeyError:
+            raise ValueError('Variable %s is not bound' % self.value)
+
+    def python_code(self, operands, namespace):
+        try:
+            return namespace['_variables'][str(self.value)]
+        except KeyError:
+            raise ValueError('Variable %s is not one of the compiled variables' % self.value)
     
-    def simplify(self):
+    def simplify(self, simplifier=None, exact=False):
         return self
         
-    def evaluate(self, dictionary={}):
+    def evaluate(self, dictionary={}, exact=False):
         # check whether the variable does appear in the dictionary
         if self.value in dictionary:
             # if so, give the variable his new value
@@ -293,7 +1358,7 @@ class Variable(Expression):
             # if not, then return the variable
             return Variable(self)
     
-    def derivative(self,variable):
+    def derivative_specific(self, variable, differentiator):
         if self==variable:
             return Constant(1)
         else:
@@ -302,191 +1367,263 @@ class Variable(Expression):
         
 class BinaryNode(Expression):
     """A node in the expression tree representing a binary operator."""
+    __slots__ = ('lhs', 'rhs')
+    # the operator itself is described by class attributes, set by every subclass
+    op_symbol = None
+    latex_symbol = None
+    precedence = 0
+    associativity = 0
+    identity = None
 
-    def __init__(self, lhs, rhs, op_symbol, precedence=0, associativity=0, identity=Constant(0)):
+    def __init__(self, lhs, rhs):
         self.lhs = lhs
         self.rhs = rhs
-        self.op_symbol = op_symbol
-        self.precedence = precedence
-        self.associativity = associativity
-        self.identity = identity
             
     def __eq__(self, other):
-        if type(self) == type(other):
-            return self.lhs == other.lhs and self.rhs == other.rhs
-        else:
+        # interned trees are equal exactly when they are the same object,
+        # otherwise the cached hashes rule out almost all unequal trees right away
+        if self is other:
+            return True
+        elif type(self) != type(other) or hash(self) != hash(other):
             return False
+        return _structurally_equal(self, other)
+
+    def __hash__(self):
+        if self._hash is None:
+            if self.lhs._hash is None or self.rhs._hash is None:
+                # hash the uncached part of the tree bottom-up, deep trees would exceed the recursion limit
+                postorder(self, _set_hash, lambda node: node._hash)
+            else:
+                self._hash = hash((type(self), self.op_symbol, self.lhs._hash, self.rhs._hash))
+        return self._hash
+
+    def children(self):
+        return (self.lhs, self.rhs)
+
+    def rebuild(self, children):
+        lhs, rhs = children
+        return type(self)(lhs, rhs)
+
+    def numeric_value(self, operands, dictionary):
+        return _BINARY_OPERATORS[self.op_symbol](operands[0], operands[1])
+
+    def batch_value(self, operands, columns):
+        return _BINARY_OPERATORS[self.op_symbol](operands[0], operands[1])
+
+    def dual_value(self, operands, duals):
+        return _BINARY_OPERATORS[self.op_symbol](operands[0], operands[1])
+
+    def python_code(self, operands, namespace):
+        return '%s %s %s' % (operands[0], self.op_symbol, operands[1])
             
     def __str__(self):
-        lstring = str(self.lhs)
-        rstring = str(self.rhs)
-        # check whether the precedence of the current BinaryNode is greater than the precendence of the lhs node. 
-        # Then we need parenthesis at least around the lhs node
-        if self.precedence > self.lhs.precedence:
-            # check whether the precendence of the current BinaryNode is greater than the precedence of the rhs node
-            # or (if the precendence of the current BinaryNode is equal to the precendence of the rhs node and the associativity of the current BinaryNode is left)
-            # if one of this also holds, then we need parenthesis around the lhs and rhs node
-            if self.precedence > self.rhs.precedence or (self.precedence == self.rhs.precedence and self.associativity == 'left'):
-                return "(%s) %s (%s)" % (lstring, self.op_symbol, rstring)
-            # if not, add only parenthesis to the lhs node   
-            else:
-                return "(%s) %s %s" % (lstring, self.op_symbol, rstring)
-        # if not, check whether the precendence of the current BinaryNode is greater than the precendence of the rhs node 
+        return _infix(self)
+
+    # the pieces of the string representation, strings and the subtrees in between them
+    def infix_parts(self):
+        parts = []
+        # check whether the precedence of the current BinaryNode is greater than the precendence of the lhs node
+        # or (if they are equal and the associativity of the current BinaryNode is right, ex: (x**2)**3).
+        # Then we need parenthesis around the lhs node
+        if self.precedence > self.lhs.precedence or (self.precedence == self.lhs.precedence and self.associativity == 'right'):
+            parts += ['(', self.lhs, ')']
+        else:
+            parts.append(self.lhs)
+        parts.append(_SPACED_SYMBOLS[self.op_symbol])
+        # check whether the precendence of the current BinaryNode is greater than the precendence of the rhs node 
         # or (if the precendence of the current BinaryNode is equal to the precendence of the rhs node and the associativity of the current BinaryNode is left)
-        # if one of these holds, then we need parenthesis only around the rhs node
-        elif self.precedence > self.rhs.precedence or (self.precedence == self.rhs.precedence and self.associativity == 'left'):
-            return "%s %s (%s)" % (lstring, self.op_symbol, rstring)
-       # if everything doesn't hold, then return the general case without parenthesis. 
-        else:
-            return "%s %s %s" % (lstring, self.op_symbol, rstring)
-
-    # evaluate the input with of without the given dictionary for variables   
-    def evaluate(self, dictionary = {}):
-        # evaluate the left- and righthandside of the expressiontree 
-        # in the beginning the leaves of the tree(i.e. the constants and variables) can be evaluated
-        links = self.lhs.evaluate(dictionary)
-        rechts = self.rhs.evaluate(dictionary)
-        # if the lefthandside isn't a constant, then run BinaryNode with "links" and "rechts"
+        # if one of these holds, then we need parenthesis around the rhs node
+        if self.precedence > self.rhs.precedence or (self.precedence == self.rhs.precedence and self.associativity == 'left'):
+            parts += ['(', self.rhs, ')']
+        else:
+            parts.append(self.rhs)
+        return parts
+
+    # the pieces of the LaTeX representation, with brackets by the same rules as infix_parts;
+    # DivNode and PowNode write their own, a fraction or exponent needs no brackets around its parts
+    def latex_parts(self):
+        parts = []
+        lhs = _latex_precedence(self.lhs)
+        if self.precedence > lhs or (self.precedence == lhs and self.associativity == 'right'):
+            parts += ['\\left(', self.lhs, '\\right)']
+        else:
+            parts.append(self.lhs)
+        parts.append(_SPACED_SYMBOLS[self.latex_symbol])
+        rhs = _latex_precedence(self.rhs)
+        if self.precedence > rhs or (self.precedence == rhs and self.associativity == 'left'):
+            parts += ['\\left(', self.rhs, '\\right)']
+        else:
+            parts.append(self.rhs)
+        return parts
+
+    # evaluate the node, given the evaluated left- and righthandside of the expressiontree
+    def evaluate_step(self, operands, dictionary):
+        # in the beginning the leaves of the tree(i.e. the constants and variables) are evaluated
+        links, rechts = operands
+        # if the lefthandside isn't a constant, then build the same operator with "links" and "rechts"
         if not isinstance(links, Constant):
-            return BinaryNode(links, rechts, self.op_symbol, self.precedence, self.associativity)
-        # if the righthandside isn't a constant either, then also run BinaryNode with "links" and "rechts"
+            return type(self)(links, rechts)
+        # if the righthandside isn't a constant either, then also build it with "links" and "rechts"
         elif not isinstance(rechts, Constant):
-            return BinaryNode(links, rechts, self.op_symbol, self.precedence, self.associativity)
-        # if the left- and righthandside are constants, then evaluate the value
+            return type(self)(links, rechts)
+        # if the left- and righthandside are constants, then compute the value
         else: 
-            # check whether the lefthandside has precedence three, then it's a NegNode and we want parenthesis around it
-            if links.precedence == 3:
-                return Constant(eval("(%s) %s %s" % (links, self.op_symbol, rechts)))
-            # check whether the righthandside has precedence three, then it's a NegNode and we want parenthesis around it.    
-            elif rechts.precedence == 3:
-                return Constant(eval("%s %s (%s)" % (links, self.op_symbol, rechts)))
-            # if not, then we don't want parenthesis and we can eval it immediately
-            else:
-                return Constant(eval("%s %s %s" % (links, self.op_symbol, rechts)))
+            return Constant(_fold(self.op_symbol, links.value, rechts.value))
 
-    def simplify(self):
-        left=(self.lhs).simplify()
-        right=(self.rhs).simplify()
+    # one rewrite step, called by the Simplifier once the operands are simplified: the tree a rule
+    # rewrites the node to (the Simplifier simplifies that one in turn), the node itself when no rule applies,
+    # or a generator giving the combined like terms of a sum or product (see Simplifier.collect)
+    def simplify_step(self):
         z=self.simplify_specific()
-        T=type(z)
-        if T==Constant:
-            return z
-        elif T==Variable:
-            return z
-        elif T==NegNode:
-            return z
-        elif T in [CosNode,SinNode,TanNode,LogNode]:
+        # a rule of simplify_specific applies
+        if z is not self:
             return z
-        else:
-            left=z.lhs.simplify()
-            right=z.rhs.simplify()
-            op_symbol=z.op_symbol
-            # writes a BinaryNode of Constants, incl NegNode(Constant), to one Constant
-            if (type(left)==Constant or (type(left)==NegNode and type(left.operand)==Constant)) and (type(right)==Constant or (type(right)==NegNode and type(right.operand)==Constant)):
-                return Constant(eval("(%s) %s (%s)" % (left, op_symbol, right)))
-            elif z.associativity=='both':
-                if left==z.identity:
-                    return right
-                elif right==z.identity:
-                    return left
-                # ex: x+a+b=x+(b+a) and x-a+b=x+(b-a)
-                elif left.precedence==z.precedence and T(right,left.rhs).simplify() != T(right,left.rhs):
-                    K=type(left)
-                    return T(left.lhs,K(right, left.rhs)).simplify()
-                # ex: a-b+c=(a+c)-b
-                elif left.precedence==z.precedence and T(left.lhs,right).simplify() != T(left.lhs,right):
-                    K=type(left)
-                    return K(T(left.lhs,right),left.rhs).simplify()
-                # ex: a+(b-x)=(a+b)-x
-                elif right.precedence==z.precedence and T(left,right.lhs).simplify() != T(left,right.lhs):
-                    K=type(right)
-                    return K(T(left,right.lhs),right.rhs).simplify()
-                else:
-                    return T(left,right)
-            elif z.associativity=='left':
-                if right==z.identity:
-                    return left
-                elif T==SubNode and left==z.identity:
-                    return NegNode(right)
-                # ex: a+b-c=a+(b-c) 
-                elif left.precedence==z.precedence and left.associativity=='both' and T(left.rhs,right).simplify() != T(left.rhs,right):
-                    K=type(left)
-                    return K(left.lhs,T(left.rhs,right)).simplify()
-                # ex: a-b-c=(a-c)-b or a+b-c=(a-c)+b
-                elif left.precedence==z.precedence and T(left.lhs,right).simplify() != T(left.lhs,right):
-                    K=type(left)
-                    return K(T(left.lhs,right),left.rhs).simplify()
-                else:
-                    return T(left,right)
-            elif right==z.identity:
-                    return left
-            else:
-                return T(left,right)
-            
-    def derivative(self,variable):
-        # derivative function for BinaryNodes, comparable function exists for UnaryNodes, Constants etc
-        self=self.simplify()
+        left=self.lhs
+        right=self.rhs
         T=type(self)
-        if T in [MulNode,DivNode,PowNode]:
-            return self.derivative_specific(variable).simplify()
-        elif T in [AddNode,SubNode]:
-            return T(self.lhs.derivative(variable),self.rhs.derivative(variable)).simplify()
+        # writes a BinaryNode of Constants, incl NegNode(Constant), to one Constant
+        if (type(left)==Constant or (type(left)==NegNode and type(left.operand)==Constant)) and (type(right)==Constant or (type(right)==NegNode and type(right.operand)==Constant)):
+            return Constant(_fold(self.op_symbol, _constant_of(left), _constant_of(right), Simplifier.active().exact))
+        elif self.associativity=='both':
+            if left==self.identity:
+                return right
+            elif right==self.identity:
+                return left
+            # ex: x+a+b=x+(a+b), a-b+c+b=a+c and x*y*x=x**2*y: combine like terms of the whole sum or product
+            else:
+                return Simplifier.active().collect(self, T, left, right)
+        elif self.associativity=='left':
+            if right==self.identity:
+                return left
+            elif T==SubNode and left==self.identity:
+                return NegNode(right)
+            # ex: a+b-b=a and a-b-c+c=a-b
+            else:
+                return Simplifier.active().collect(self, T, left, right)
+        elif right==self.identity:
+            return left
         else:
-            return self.derivative(variable).simplify()
-        
+            return self
+            
+
 class UnaryNode(Expression):
     """A node in the expression tree representing a unary operator."""
-    def __init__(self, operand, op_symbol, precedence=0):
+    __slots__ = ('operand',)
+    op_symbol = None
+    precedence = 0
+    associativity = 'both'
+    identity = None
+
+    def __init__(self, operand):
         self.operand = operand
-        self.op_symbol = op_symbol
-        self.precedence = precedence
     
     def __str__(self):
+        return _infix(self)
+
+    # the pieces of the string representation, strings and the subtree in between them
+    def infix_parts(self):
         if self.op_symbol in ['sin', 'cos', 'tan', 'log']:
-            return "%s(%s)" % (self.op_symbol, self.operand)
+            return ['%s(' % self.op_symbol, self.operand, ')']
         elif type(self)==FunctionNode:
-            return "%s(%s)" % (self.op_symbol,self.operand)
+            return ['%s(' % self.op_symbol, self.operand, ')']
         elif type(self)==NegNode:
             if self.operand==Constant(0):
-                return str(Constant(0))
+                return [str(Constant(0))]
             elif type(self.operand) in [Constant,Variable]:
-                return self.op_symbol+str(self.operand)
+                return [self.op_symbol, self.operand]
             else:
-                return "%s(%s)" % (self.op_symbol, self.operand)   
+                return ['%s(' % self.op_symbol, self.operand, ')']
         else:
-            return self.op_symbol+str(self.operand)
+            return [self.op_symbol, self.operand]
+
+    # the pieces of the LaTeX representation; a function gets its argument in brackets,
+    # a negation only an operand that is a sum, difference, product or negative itself
+    def latex_parts(self):
+        if type(self) == FunctionNode:
+            return ['\\mathrm{%s}\\left(' % self.op_symbol, self.operand, '\\right)']
+        elif self.op_symbol in ['sin', 'cos', 'tan', 'log']:
+            return ['\\%s\\left(' % self.op_symbol, self.operand, '\\right)']
+        elif _latex_precedence(self.operand) <= self.precedence:
+            return [self.op_symbol, '\\left(', self.operand, '\\right)']
+        return [self.op_symbol, self.operand]
         
     def __eq__(self, other):
-        if type(self)==type(other):
-            return self.operand==other.operand
-        else:
+        if self is other:
+            return True
+        elif type(self) != type(other) or hash(self) != hash(other):
             return False
+        return _structurally_equal(self, other)
+
+    def __hash__(self):
+        if self._hash is None:
+            if self.operand._hash is None:
+                postorder(self, _set_hash, lambda node: node._hash)
+            else:
+                self._hash = hash((type(self), str(self.op_symbol), self.operand._hash))
+        return self._hash
+
+    def children(self):
+        return (self.operand,)
+
+    def rebuild(self, children):
+        return type(self)(children[0])
+
+    def numeric_value(self, operands, dictionary):
+        if self.op_symbol in ['sin', 'cos', 'tan', 'log']:
+            return getattr(math, self.op_symbol)(operands[0])
+        return -operands[0]
+
+    def batch_value(self, operands, columns):
+        if self.op_symbol in ['sin', 'cos', 'tan', 'log']:
+            return getattr(np, self.op_symbol)(operands[0])
+        return -operands[0]
+
+    def dual_value(self, operands, duals):
+        if self.op_symbol in ['sin', 'cos', 'tan', 'log']:
+            return getattr(operands[0], self.op_symbol)()
+        return -operands[0]
+
+    def python_code(self, operands, namespace):
+        if self.op_symbol in ['sin', 'cos', 'tan', 'log']:
+            return '%s.%s(%s)' % (namespace['_module'], self.op_symbol, operands[0])
+        return '%s%s' % (self.op_symbol, operands[0])
             
-    def evaluate(self, dictionary = {}):
-        # first evaluate the operand with the dictionary
-        x = self.operand.evaluate(dictionary)
+    # evaluate the node, given the evaluated operand
+    def evaluate_step(self, operands, dictionary):
+        x = operands[0]
         # check whether the op_symbol is a standard function
         if self.op_symbol in ['sin', 'cos', 'tan', 'log']:
             # check whether x represents a variable
             if isinstance(x, Variable):
                 # if so, then it can't be evaluated. So we want the whole operation to represent as a variable 
                 return Variable("%s(%s)" % (self.op_symbol, x))
-            # if not, then eval it and return it as a constant
+            # if not, then compute it and return it as a constant
             else:
-                return Constant(eval('math.'+str(self.op_symbol)+'('+str(x)+')'))
+                return Constant(getattr(math, self.op_symbol)(x.value))
         # check whether x is a variable
         if isinstance(x, Variable):
             #if so, return it as a variable
             return Variable("%s%s" % (self.op_symbol, x))
         #if not, return it as a constant
         else:
-            return Constant(eval("%s%s" % (self.op_symbol, x)))
+            return Constant(-x.value)
+
+    # one rewrite step, called by the Simplifier once the operand is simplified
+    def simplify_step(self):
+        return self.simplify_specific()
+
+    def simplify_specific(self):
+        return self
 
     
 class AddNode(BinaryNode):
     """Represents the addition operator"""
-    def __init__(self, lhs, rhs):
-        super(AddNode, self).__init__(lhs, rhs, '+', 1, 'both', )
+    __slots__ = ()
+    op_symbol = '+'
+    latex_symbol = '+'
+    precedence = 1
+    associativity = 'both'
+    identity = Constant(0)
 
     def simplify_specific(self):
         left=self.lhs
@@ -495,34 +1632,43 @@ class AddNode(BinaryNode):
         #rules for NegNode
         # ex: a+-b=a-b
         if type(right)==NegNode:
-            return (left-right.operand).simplify()
+            return left-right.operand
         # ex: a+-b*c=a-b*c and a+-b/c=a-b/c
         elif type(right) in [MulNode,DivNode] and type(right.lhs)==NegNode:
             K=type(right)
-            return (left-K(right.lhs.operand,right.rhs)).simplify()
+            return left-K(right.lhs.operand,right.rhs)
     
         # Constants should be right of a non Constant/NedNode
         elif type(left)==Constant and type(right)!=Constant and type(right)!=NegNode:
-            return (right+left).simplify()
+            return right+left
         # ex: x+x=2*x
         elif left==right:
             return (Constant(2)*right)
         # ex: a*x+b*x=(a+b)*x
         elif type(left)==type(right)==MulNode and left.rhs==right.rhs:
-            return ((left.lhs+right.lhs)*left.rhs).simplify()
+            return (left.lhs+right.lhs)*left.rhs
         # ex: a*x+x=(a+1)*x
         elif type(left)==MulNode and left.rhs==right:
-            return ((left.lhs+Constant(1))*left.rhs).simplify()
+            return (left.lhs+Constant(1))*left.rhs
         # ex: x+a*x=(1+a)*x
         elif type(right)==MulNode and left==right.rhs:
-            return ((Constant(1)+right.lhs)*left).simplify()
+            return (Constant(1)+right.lhs)*left
         else:
-            return left+right
+            return self
+
+    def derivative_specific(self, variable, differentiator):
+        left=differentiator.differentiate(self.lhs,variable)
+        right=differentiator.differentiate(self.rhs,variable)
+        return left+right
 
 class SubNode(BinaryNode):
     """Represents the substraction operator"""
-    def __init__(self, lhs, rhs):
-        super(SubNode, self).__init__(lhs, rhs, '-', 1, 'left', )
+    __slots__ = ()
+    op_symbol = '-'
+    latex_symbol = '-'
+    precedence = 1
+    associativity = 'left'
+    identity = Constant(0)
 
     def simplify_specific(self):
         left=self.lhs
@@ -531,34 +1677,43 @@ class SubNode(BinaryNode):
         #extra rules for NegNode:
         # ex: x-(-a)=x+a
         if type(right)==NegNode:
-            return (left+right.operand).simplify()
+            return left+right.operand
         # ex: a--b*c=a+b*c and a--b/c=a+b/c
         elif type(right) in [MulNode,DivNode] and type(right.lhs)==NegNode:
             K=type(right)
-            return (left+K(right.lhs.operand,right.rhs)).simplify()
+            return left+K(right.lhs.operand,right.rhs)
         # ex: (x-a)-b=x-(a+b)
         elif type(left)==SubNode and type(left.rhs)==type(right)==Constant:
             a=left.rhs.value+right.value
-            return (left.lhs-Constant(a)).simplify()
+            return left.lhs-Constant(a)
         # ex: x-x=0
         elif left==right:
             return Constant(0)
         # ex: a*x-b*x=(a-b)*x
         elif type(left)==type(right)==MulNode and left.rhs==right.rhs:
-            return ((left.lhs-right.lhs)*left.rhs).simplify()
+            return (left.lhs-right.lhs)*left.rhs
         # ex: a*x+x=(a-1)*x
         elif type(left)==MulNode and left.rhs==right:
-            return ((left.lhs-Constant(1))*left.rhs).simplify()
+            return (left.lhs-Constant(1))*left.rhs
         # ex: x-a*x=(1-a)*x
         elif type(right)==MulNode and left==right.rhs:
-            return ((Constant(1)-right.lhs)*left).simplify()
+            return (Constant(1)-right.lhs)*left
         else:
-            return left-right
+            return self
+
+    def derivative_specific(self, variable, differentiator):
+        left=differentiator.differentiate(self.lhs,variable)
+        right=differentiator.differentiate(self.rhs,variable)
+        return left-right
 
 class MulNode(BinaryNode):
     """Represents the multiplication operator"""
-    def __init__(self, lhs, rhs):
-        super(MulNode, self).__init__(lhs, rhs, '*', 2, 'both', Constant(1))
+    __slots__ = ()
+    op_symbol = '*'
+    latex_symbol = '\\cdot'
+    precedence = 2
+    associativity = 'both'
+    identity = Constant(1)
 
     def simplify_specific(self):
         left=self.lhs
@@ -567,50 +1722,56 @@ class MulNode(BinaryNode):
         # rules for NegNode
         # ex: (-a)*(-b)=a*b
         if type(left)==type(right)==NegNode:
-            return (left.operand*right.operand).simplify()
+            return left.operand*right.operand
         # ex: a*(-b)=-(a*b)
         elif type(right)==NegNode:
-            return (-(left*right.operand)).simplify() 
+            return -(left*right.operand)
         # ex: x*a=a*x
         elif type(right)==Constant and type(left)!=Constant:
-            return (right*left).simplify()
+            return right*left
         # ex: a*(b*x)=(a*b)*x
         elif type(right)==MulNode and type(left)==type(right.lhs)==Constant:
             a=left.value*right.lhs.value
-            return (Constant(a)*right.rhs).simplify()
+            return Constant(a)*right.rhs
         # ex: 0*x=0
         elif left==Constant(0) or left==NegNode(Constant(0)):
             return Constant(0)
         # ex: x*x=x**2
         elif left==right:
-            return (left**Constant(2)).simplify()
+            return left**Constant(2)
         # ex: x**a*x**b=x**(a+b)
         elif type(left)==type(right)==PowNode and left.lhs==right.lhs:
-            return (left.lhs**(left.rhs+right.rhs)).simplify()
+            return left.lhs**(left.rhs+right.rhs)
         # ex: x**a*x=x**(a+1)
         elif type(left)==PowNode and left.lhs==right:
-            return (left.lhs**(left.rhs+Constant(1))).simplify()
+            return left.lhs**(left.rhs+Constant(1))
         # ex: x*x**a=x**(1+a)
         elif type(right)==PowNode and left==right.lhs:
-            return (left**(Constant(1)+right.rhs)).simplify()
-        # ex: a(b+x)=a*b+a*x and a(b-x)=a*b-a*x
+            return left**(Constant(1)+right.rhs)
+        # ex: a(b+x)=a*b+a*x and a(b-x)=a*b-a*x, over all terms of the sum at once
         elif right.precedence==1:
-            return type(right)(left*right.lhs,left*right.rhs).simplify()
+            return _distribute(left, right)
         else:
-            return left*right
+            return self
 
-    def derivative_specific(self,variable):
+    def derivative_specific(self, variable, differentiator):
         # product rule for derivatives
-        L=self.lhs.simplify()
-        R=self.rhs.simplify()
-        left=L.derivative(variable)
-        right=R.derivative(variable)
-        return (L*right+left*R).simplify()
+        L=self.lhs
+        R=self.rhs
+        left=differentiator.differentiate(L,variable)
+        right=differentiator.differentiate(R,variable)
+        return L*right+left*R
         
 class DivNode(BinaryNode):
     """Represents the division operator"""
-    def __init__(self, lhs, rhs):
-        super(DivNode, self).__init__(lhs, rhs, '/', 2, 'left', Constant(1))
+    __slots__ = ()
+    op_symbol = '/'
+    precedence = 2
+    associativity = 'left'
+    identity = Constant(1)
+
+    def latex_parts(self):
+        return ['\\frac{', self.lhs, '}{', self.rhs, '}']
 
     def simplify_specific(self):
         left=self.lhs
@@ -619,10 +1780,10 @@ class DivNode(BinaryNode):
         # rules for NegNode
         # ex: (-a)/(-b)=a/b
         if type(left)==type(right)==NegNode:
-            return (left.operand/right.operand).simplify()
+            return left.operand/right.operand
         # ex: a/(-b)=-(a/b)
         elif type(right)==NegNode:
-            return (-(left/right.operand)).simplify() 
+            return -(left/right.operand)
         
         # ex: 0/x=0
         elif left==Constant(0):
@@ -632,29 +1793,39 @@ class DivNode(BinaryNode):
             return Constant(1)
         # ex: x**a/x**b=x**(a-b)
         elif type(left)==type(right)==PowNode and left.lhs==right.lhs:
-            return (left.lhs**(left.rhs-right.rhs)).simplify()
+            return left.lhs**(left.rhs-right.rhs)
         # ex: x**a*x=x**(a-1)
         elif type(left)==PowNode and left.lhs==right:
-            return (left.lhs**(left.rhs-Constant(1))).simplify()
+            return left.lhs**(left.rhs-Constant(1))
         # ex: x*x**a=x**(1-a)
         elif type(right)==PowNode and left==right.lhs:
-            return (left**(Constant(1)-right.rhs)).simplify()
+            return left**(Constant(1)-right.rhs)
         else:
-            return left/right
+            return self
 
-    def derivative_specific(self,variable):
+    def derivative_specific(self, variable, differentiator):
         # quotient rule for derivatives
-        L=self.lhs.simplify()
-        R=self.rhs.simplify()
-        left=L.derivative(variable)
-        right=R.derivative(variable)
-        return ((left*R-L*right)/(R*R)).simplify()
+        L=self.lhs
+        R=self.rhs
+        left=differentiator.differentiate(L,variable)
+        right=differentiator.differentiate(R,variable)
+        return (left*R-L*right)/(R*R)
         
 class PowNode(BinaryNode):
     """Represents the power operator"""
-    def __init__(self, lhs, rhs):
-        super(PowNode, self).__init__(lhs, rhs, '**', 4, 'right', Constant(1))
+    __slots__ = ()
+    op_symbol = '**'
+    precedence = 4
+    associativity = 'right'
+    identity = Constant(1)
 
+    # only a variable or a plain non-negative number is written as the base without brackets
+    def latex_parts(self):
+        base = self.lhs
+        if type(base) == Variable or (type(base) == Constant and _latex_precedence(base) == 6 and base.value >= 0
+                                      and not isinstance(base.value, fractions.Fraction)):
+            return [base, '^{', self.rhs, '}']
+        return ['\\left(', base, '\\right)^{', self.rhs, '}']
 
     def simplify_specific(self):
         left=self.lhs
@@ -665,130 +1836,1574 @@ class PowNode(BinaryNode):
             return Constant(1)
         # ex: (x**a)**b=x**(a*b)
         elif type(left)==PowNode:
-            return (left.lhs**(left.rhs*right)).simplify()
+            return left.lhs**(left.rhs*right)
         # ex: (a*x)**b=a**b*x**b
         elif type(left)==MulNode:
-            return (left.lhs**right*left.rhs**right).simplify()
+            return left.lhs**right*left.rhs**right
         else:
-            return left**right
+            return self
 
-    def derivative_specific(self,variable):
-        L=self.lhs.simplify()
-        R=self.rhs.simplify()
-        left=L.derivative(variable)
-        right=R.derivative(variable)
+    def derivative_specific(self, variable, differentiator):
+        L=self.lhs
+        R=self.rhs
+        left=differentiator.differentiate(L,variable)
+        right=differentiator.differentiate(R,variable)
+        name=str(variable.value)
         # if at least L is a function with the specific variable
-        if str(variable) in str(L):
+        if differentiator.depends(L, name):
             # if also R is a function with the specific variable
-            if str(variable) in str(R):
-                return (Constant(math.e)**(R*LogNode(L))*(right*LogNode(L)+left*R/L)).simplify()
+            if differentiator.depends(R, name):
+                return Constant(math.e)**(R*LogNode(L))*(right*LogNode(L)+left*R/L)
             #only L is a function:
             else:
-                return ((R*L**(R-Constant(1)))*left).simplify()
+                return (R*L**(R-Constant(1)))*left
         # if only R is a function with the specific variable
-        elif str(variable) in str(R):
-            return (L**R*LogNode(L)*right).simplify()
+        elif differentiator.depends(R, name):
+            return L**R*LogNode(L)*right
         # both L and R do not contain the specific variable, so the derivative is the one of the Constant
         else:
             return Constant(0)
 
 class NegNode(UnaryNode):
     """Represents the negation operator"""
-    def __init__(self, operand):
-        super(NegNode, self).__init__(operand, '-', 3)
+    __slots__ = ()
+    op_symbol = '-'
+    precedence = 3
 
-    def simplify(self):
+    def simplify_specific(self):
+        # ex: --a=a
         if type(self.operand)==NegNode:
-            return self.operand.operand.simplify()
-        # check whether the operand can be simplified
-        elif self.operand.simplify() != self.operand:
-            return NegNode(self.operand.simplify())
+            return self.operand.operand
         #rules for eliminating brackets
         elif type(self.operand)==AddNode:
-            return (NegNode(self.operand.lhs)-self.operand.rhs).simplify()
+            return NegNode(self.operand.lhs)-self.operand.rhs
         elif type(self.operand)==SubNode:
-            return (NegNode(self.operand.lhs)+self.operand.rhs).simplify()
+            return NegNode(self.operand.lhs)+self.operand.rhs
         else:
             return self
 
-    def derivative(self,variable):
-        O=self.operand.simplify()
-        return (-O.derivative(variable)).simplify()
+    def derivative_specific(self, variable, differentiator):
+        return -differentiator.differentiate(self.operand,variable)
     
 
 class CosNode(UnaryNode): #we have to write cos(x), only works with bracket
     """ Represents the function Cosinus"""
-    def __init__(self,operand):
-        super(CosNode, self).__init__(operand, 'cos', 3)
+    __slots__ = ()
+    op_symbol = 'cos'
+    precedence = 3
 
-    def simplify(self):
-        return self
-
-    def derivative(self,variable):
-        O=self.operand.simplify()
-        op=O.derivative(variable)
-        return (NegNode(SinNode(O))*op).simplify()
+    def derivative_specific(self, variable, differentiator):
+        O=self.operand
+        op=differentiator.differentiate(O,variable)
+        return NegNode(SinNode(O))*op
    
 class SinNode(UnaryNode): #we have to write sin(x), only works with bracket
     """ Represents the function Sinus"""
-    def __init__(self,operand):
-        super(SinNode, self).__init__(operand, 'sin', 3)
+    __slots__ = ()
+    op_symbol = 'sin'
+    precedence = 3
 
-    def simplify(self):
-        return self
-    
-    def derivative(self,variable):
-        O=self.operand.simplify()
-        op=O.derivative(variable)
-        return (CosNode(O)*op).simplify()
+    def derivative_specific(self, variable, differentiator):
+        O=self.operand
+        op=differentiator.differentiate(O,variable)
+        return CosNode(O)*op
     
 class TanNode(UnaryNode): #we have to write tan(x), only works with bracket
     """ Represents the function Tangens"""
-    def __init__(self,operand):
-        super(TanNode, self).__init__(operand, 'tan', 3)
+    __slots__ = ()
+    op_symbol = 'tan'
+    precedence = 3
 
-    def simplify(self):
-        return self
-
-    def derivative(self,variable):
-        O=self.operand.simplify()
-        op=O.derivative(variable)
-        return (op/(CosNode(O)*CosNode(O))).simplify()
+    def derivative_specific(self, variable, differentiator):
+        O=self.operand
+        op=differentiator.differentiate(O,variable)
+        return op/(CosNode(O)*CosNode(O))
 
 class LogNode(UnaryNode): #we have to write log(x), only works with bracket
     """ Represents the function Logarithm"""
-    def __init__(self,operand):
-        super(LogNode, self).__init__(operand, 'log', 3)     
+    __slots__ = ()
+    op_symbol = 'log'
+    precedence = 3
 
-    def simplify(self):
+    def simplify_specific(self):
         if self.operand==Constant(math.e):
             return Constant(1)
         else:
             return self
 
-    def derivative(self,variable):
-        O=self.operand.simplify()
-        op=O.derivative(variable)
-        return (op/O).simplify()
+    def derivative_specific(self, variable, differentiator):
+        O=self.operand
+        op=differentiator.differentiate(O,variable)
+        return op/O
 
             
 class FunctionNode(UnaryNode): #we can use a function in a string written with two letters or one letter and one constant, e.g. f(x) or f(2) 
     """Represents an arbitrary function"""
+    __slots__ = ('op_symbol',)
+    precedence = 3
+
     def __init__(self,naam, operand):
-        super(FunctionNode,self).__init__(operand, naam, 3)
-        
+        self.op_symbol = naam
+        self.operand = operand
+
+    def rebuild(self, children):
+        return FunctionNode(self.op_symbol, children[0])
+
+    def numeric_value(self, operands, dictionary):
+        raise ValueError('Unknown function %s can not be evaluated' % self.op_symbol)
+
+    def batch_value(self, operands, columns):
+        # an unknown function can't be evaluated, it stays part of the result
+        return _batch_residual(self, operands)
+
+    def dual_value(self, operands, duals):
+        raise ValueError('Unknown function %s can not be differentiated' % self.op_symbol)
+
+    def python_code(self, operands, namespace):
+        raise ValueError('Unknown function %s can not be compiled' % self.op_symbol)
+
+    def derivative_specific(self, variable, differentiator):
+        raise ValueError('Unknown function %s can not be differentiated' % self.op_symbol)
+
+
+# the node classes of a sum and of a product, by precedence: the one adding a term (or factor), and
+# the one subtracting it (or dividing by it). See Simplifier.collect
+_SPINES = {1: (AddNode, SubNode), 2: (MulNode, DivNode)}
+
+# the key of all constant terms
+_CONSTANT_KEY = object()
+
+# the terms of a sum or the factors of a product, as (sign, term) in order, without recursion;
+# a sign of -1 marks a subtracted term or a divisor
+def _spine_terms(expression, plus, minus, sign):
+    terms = []
+    stack = [(expression, sign)]
+    while stack:
+        node, sign = stack.pop()
+        if type(node) == plus:
+            stack.append((node.rhs, sign))
+            stack.append((node.lhs, sign))
+        elif type(node) == minus:
+            stack.append((node.rhs, -sign))
+            stack.append((node.lhs, sign))
+        else:
+            terms.append((sign, node))
+    return terms
+
+# the sum or product of first and the signed terms, written out left-deep: first + t1 - t2 ... or first * t1 / t2 ...
+def _left_deep(first, terms, plus, minus):
+    result = first
+    for sign, term in terms:
+        result = (plus if sign > 0 else minus)(result, term)
+    return result
+
+# the sum (or product) node with plus and minus as its classes, with the terms of its right operand written
+# out left-deep on top of its left operand
+def _written_left_deep(node, plus, minus):
+    return _left_deep(node.lhs, _spine_terms(node.rhs, plus, minus, 1 if type(node) == plus else -1), plus, minus)
+
+# the sum a*t1 + a*t2 - a*t3 ... of the products of factor with the terms of a sum expression, without recursion
+def _distribute(factor, expression):
+    terms = _spine_terms(expression, AddNode, SubNode, 1)
+    sign, term = terms[0]
+    result = factor * term if sign > 0 else NegNode(factor * term)
+    for sign, term in terms[1:]:
+        result = result + factor * term if sign > 0 else result - factor * term
+    return result
+
+# terms that can combine have the same key: all constants; in a sum (plus is AddNode) x, a*x and -x;
+# in a product x and x**a. Terms with the same key that don't simplify together are kept apart
+def _spine_key(term, plus):
+    if type(term) == Constant or (type(term) == NegNode and type(term.operand) == Constant):
+        return _CONSTANT_KEY
+    if plus == AddNode:
+        if type(term) == NegNode:
+            term = term.operand
+        if type(term) == MulNode:
+            return term.rhs
+    elif type(term) == PowNode:
+        return term.lhs
+    return term
+
+# the operator symbols with a space on both sides, shared by all nodes so that the emitter
+# holds one string per operator instead of one per node
+_SPACED_SYMBOLS = dict((symbol, ' %s ' % symbol) for cls in [AddNode, SubNode, MulNode, DivNode, PowNode]
+                       for symbol in [cls.op_symbol, cls.latex_symbol] if symbol is not None)
+
+# the targets of Expression.emit: the pieces of an inner node, and the text of a leaf
+_EMIT_TARGETS = {'infix': (lambda node: node.infix_parts(), str),
+                 'python': (lambda node: _python_parts(node, 'math'), _python_leaf),
+                 'numpy': (lambda node: _python_parts(node, 'np'), _python_leaf),
+                 'latex': (lambda node: node.latex_parts(), lambda node: node.latex())}
+
+# binary operators known to the parser, with their precedence and associativity taken from the node classes
+_PARSER_OPERATORS = dict((cls.op_symbol, (cls.precedence, cls.associativity == 'right', cls))
+                         for cls in [AddNode, SubNode, MulNode, DivNode, PowNode])
+
+# functions known to the parser, other functions become a FunctionNode
+_PARSER_FUNCTIONS = {'sin': SinNode, 'cos': CosNode, 'tan': TanNode, 'log': LogNode}
+
+class _Parser():
+    """Precedence climbing parser, builds the expression tree directly from the tokens of scan()"""
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.index = 0
+
+    def peek(self):
+        if self.index < len(self.tokens):
+            return self.tokens[self.index]
+        return (None, None)
+
+    def closing_bracket(self):
+        kind, value = self.peek()
+        if kind != 'rparen':
+            raise ValueError('Expected ) but found %s' % (value if kind else 'end of input'))
+        self.index += 1
+
+    def parse(self):
+        tree = self.expression(1)
+        if self.index < len(self.tokens):
+            raise ValueError('Unexpected token: %s' % self.tokens[self.index][1])
+        return tree
+
+    # parse operands joined by operators of at least the given precedence
+    # left associative chains are built in the loop, so long sums don't recurse
+    def expression(self, precedence):
+        lhs = self.unary()
+        while True:
+            kind, value = self.peek()
+            if kind != 'operator' or _PARSER_OPERATORS[value][0] < precedence:
+                return lhs
+            self.index += 1
+            operator_precedence, right, cls = _PARSER_OPERATORS[value]
+            rhs = self.expression(operator_precedence if right else operator_precedence + 1)
+            lhs = cls(lhs, rhs)
+
+    def unary(self):
+        kind, value = self.peek()
+        if kind == 'operator' and value in ['-', '+']:
+            self.index += 1
+            # negation binds stronger than * and /, but weaker than ** (the precedence of a NegNode)
+            operand = self.expression(NegNode.precedence)
+            return NegNode(operand) if value == '-' else operand
+        return self.primary()
+
+    def primary(self):
+        kind, value = self.peek()
+        self.index += 1
+        if kind == 'number':
+            return Constant(value)
+        elif kind == 'name':
+            if self.peek()[0] != 'lparen':
+                return Variable(value)
+            self.index += 1
+            operand = self.expression(1)
+            self.closing_bracket()
+            if value in _PARSER_FUNCTIONS:
+                return _PARSER_FUNCTIONS[value](operand)
+            return FunctionNode(value, operand)
+        elif kind == 'lparen':
+            tree = self.expression(1)
+            self.closing_bracket()
+            return tree
+        elif kind is None:
+            raise ValueError('Unexpected end of input')
+        raise ValueError('Unexpected token: %s' % value)
+
+
+# trees made by Expression.fromString, keyed on the formula
+# use parse_cache.resize(n) to change its size (0 switches it off) and parse_cache.stats() for statistics
+parse_cache = LRUCache(4096)
+
+# compiled functions made by Expression.compile, keyed on (expression, variables, vectorized)
+_compile_cache = LRUCache(1024)
+
+def clear_compile_cache():
+    _compile_cache.clear()
+
+# build the source of a function computing the expressions, one assignment per node
+# (so deep trees don't run into the nesting limits of the Python parser), and compile it;
+# with many=True the function returns a tuple with the value of every expression
+def _compile(expressions, variables, vectorized, many=False):
+    arguments = ['_v%d' % i for i in range(len(variables))]
+    namespace = {'_variables': dict(zip(variables, arguments)),
+                 '_module': '_np' if vectorized else 'math'}
+    lines = []
+    if vectorized:
+        lines += ['    %s = _np.asarray(%s, dtype=float)' % (a, a) for a in arguments]
+    # temporaries holds the name of every computed right hand side, names that of every visited node
+    temporaries = {}
+    names = {}
+    results = [_python_code(expression, lines, namespace, temporaries, names) for expression in expressions]
+    if vectorized:
+        results = ['_broadcast(%s, %s)' % (result, ', '.join(arguments)) for result in results]
+    else:
+        results = ['float(%s)' % result for result in results]
+    if many:
+        lines.append('    return (%s)' % ''.join(result + ', ' for result in results))
+    else:
+        lines.append('    return %s' % results[0])
+    source = 'def _compiled(%s):\n%s\n' % (', '.join(arguments), '\n'.join(lines))
+    del namespace['_variables'], namespace['_module']
+    namespace.update({'math': math, '_broadcast': _broadcast})
+    if vectorized:
+        namespace['_np'] = np._load()
+    exec(compile(source, '<compiled expression>', 'exec'), namespace)
+    function = namespace['_compiled']
+    function.source = source
+    return function
+
+# append the assignments for a subtree to lines, returns the name (or literal) holding its value.
+# Every value is computed once: a node that was visited before (shared between subtrees or expressions)
+# is skipped, and an assignment with the same right hand side as an earlier one reuses its name,
+# which removes subtrees that are equal but not shared
+def _python_code(expression, lines, namespace, temporaries, names):
+    def visit(node, operands):
+        code = node.python_code(operands, namespace)
+        if operands:
+            name = temporaries.get(code)
+            if name is None:
+                name = temporaries[code] = '_t%d' % len(lines)
+                lines.append('    %s = %s' % (name, code))
+            code = name
+        names[id(node)] = code
+        return code
+    return postorder(expression, visit, lambda node: names.get(id(node)))
+
+# the Python operator belonging to every binary op_symbol
+_BINARY_OPERATORS = {'+': operator.add, '-': operator.sub, '*': operator.mul,
+                     '/': operator.truediv, '**': operator.pow}
+
+# the value of a subtree of which all variables are bound in dictionary, as a plain number
+def _numeric_value(expression, dictionary, exact=False):
+    if exact:
+        def visit(node, operands):
+            if isinstance(node, BinaryNode):
+                return _fold(node.op_symbol, operands[0], operands[1], True)
+            return node.numeric_value(operands, dictionary)
+        return postorder(expression, visit)
+    return postorder(expression, lambda node, operands: node.numeric_value(operands, dictionary))
+
+# evaluate() computes a subtree without unbound variables directly, without intermediate Constants;
+# bound is the table of _bound_subtrees
+def _evaluate_bound(node, dictionary, exact, bound):
+    if bound[node]:
+        return Constant(_numeric_value(node, dictionary, exact))
+    return None
+
+# the value of a binary operator applied to two numbers. With exact=True, integers and Fractions give
+# an exact result: a Fraction for a division or a negative power, an int when the denominator is 1.
+# Floats stay floats, and a Fraction power (like 2**(1/2)) is irrational, that gives a float as well
+def _fold(op_symbol, left, right, exact=False):
+    if exact and isinstance(left, (int, fractions.Fraction)) and isinstance(right, (int, fractions.Fraction)):
+        if op_symbol == '/':
+            value = fractions.Fraction(left) / right
+        elif op_symbol == '**' and isinstance(right, fractions.Fraction) and right.denominator != 1:
+            return float(left) ** float(right)
+        elif op_symbol == '**':
+            value = fractions.Fraction(left) ** int(right)
+        else:
+            value = _BINARY_OPERATORS[op_symbol](left, right)
+        if isinstance(value, fractions.Fraction) and value.denominator == 1:
+            return int(value)
+        return value
+    return _BINARY_OPERATORS[op_symbol](left, right)
+
+# the number of a Constant or a NegNode of a Constant
+def _constant_of(expression):
+    if type(expression) == NegNode:
+        return -expression.operand.value
+    return expression.value
+
+# the value of a subtree for all bindings of evaluate_batch: an array (or NumPy scalar),
+# or, when it depends on unbound variables, an expression or array of expressions
+def _evaluate_batch(expression, columns):
+    def visit(node, operands):
+        for operand in operands:
+            if isinstance(operand, Expression) or (isinstance(operand, np.ndarray) and operand.dtype == object):
+                return _batch_residual(node, operands)
+        return node.batch_value(operands, columns)
+    return postorder(expression, visit)
+
+# rebuild node on top of partially evaluated operands; numbers become Constants, and
+# when an operand is an array the node is rebuilt for every element
+def _batch_residual(node, operands):
+    operands = [_residual_operand(operand) for operand in operands]
+    if any(isinstance(operand, np.ndarray) for operand in operands):
+        rebuild = np.frompyfunc(lambda *children: node.rebuild(children), len(operands), 1)
+        return rebuild(*operands)
+    return node.rebuild(operands)
+
+def _residual_operand(operand):
+    if isinstance(operand, Expression):
+        return operand
+    elif isinstance(operand, np.ndarray) and operand.ndim > 0:
+        if operand.dtype == object:
+            return operand
+        return np.frompyfunc(lambda value: Constant(float(value)), 1, 1)(operand)
+    return Constant(float(operand))
+
+# give the result of a vectorized function the broadcast shape of its arguments
+def _broadcast(value, *arrays):
+    shape = np.broadcast_shapes(*[a.shape for a in arrays])
+    if isinstance(value, np.ndarray) and value.shape == shape:
+        return value
+    return value + np.zeros(shape)
+
+
+class Dual():
+    """A dual number: a value together with its partial derivatives, used by Expression.value_and_gradient"""
+    __slots__ = ('value', 'partials')
+
+    # value is a number or an array; partials is a tuple with one derivative per variable, None for
+    # a derivative that is zero, or None instead of the tuple when all derivatives are zero
+    def __init__(self, value, partials=None):
+        self.value = value
+        self.partials = partials
+
+    def __add__(self, other):
+        return Dual(self.value + other.value, _chain(self.partials, 1.0, other.partials, 1.0))
+
+    def __sub__(self, other):
+        return Dual(self.value - other.value, _chain(self.partials, 1.0, other.partials, -1.0))
+
+    def __mul__(self, other):
+        return Dual(self.value * other.value, _chain(self.partials, other.value, other.partials, self.value))
+
+    # (a/b)' = a'/b - (a/b)*b'/b
+    def __truediv__(self, other):
+        quotient = self.value / other.value
+        return Dual(quotient, _chain(self.partials, 1.0 / other.value, other.partials, -quotient / other.value))
+
+    def __pow__(self, other):
+        power = self.value ** other.value
+        if other.partials is None:
+            # a constant exponent, this also avoids the log of a negative base
+            if self.partials is None:
+                return Dual(power)
+            return Dual(power, _chain(self.partials, other.value * self.value ** (other.value - 1), None, 0.0))
+        # (a**b)' = a**b * (b'*log(a) + b*a'/a)
+        return Dual(power, _chain(self.partials, power * other.value / self.value,
+                                  other.partials, power * np.log(self.value)))
+
+    def __neg__(self):
+        return Dual(-self.value, _chain(self.partials, -1.0, None, 0.0))
+
+    def sin(self):
+        return Dual(np.sin(self.value), _chain(self.partials, np.cos(self.value), None, 0.0))
+
+    def cos(self):
+        return Dual(np.cos(self.value), _chain(self.partials, -np.sin(self.value), None, 0.0))
+
+    def tan(self):
+        return Dual(np.tan(self.value), _chain(self.partials, 1.0 / np.cos(self.value) ** 2, None, 0.0))
+
+    def log(self):
+        return Dual(np.log(self.value), _chain(self.partials, 1.0 / self.value, None, 0.0))
+
+# the partial derivatives left_scale*left + right_scale*right, skipping the derivatives that are zero
+def _chain(left, left_scale, right, right_scale):
+    if left is None and right is None:
+        return None
+    elif right is None:
+        return tuple(None if d is None else left_scale * d for d in left)
+    elif left is None:
+        return tuple(None if d is None else right_scale * d for d in right)
+    partials = []
+    for l, r in zip(left, right):
+        if l is None:
+            partials.append(None if r is None else right_scale * r)
+        elif r is None:
+            partials.append(left_scale * l)
+        else:
+            partials.append(left_scale * l + right_scale * r)
+    return tuple(partials)
+
+
+class SolverResult():
+    """The results of newton, find_root or integrate: a value per starting point or interval, with statistics"""
+    # value holds the roots or integrals; error |f(root)| or the error estimate of the integral;
+    # iterations the number of steps (or rounds of splitting) of each point
+    def __init__(self, value, converged, iterations, error, evaluations, elapsed):
+        self.value = value
+        self.converged = converged
+        self.iterations = iterations
+        self.error = error
+        self.evaluations = evaluations
+        self.elapsed = elapsed
+
+    def stats(self):
+        return {'points': int(self.converged.size), 'converged': int(np.count_nonzero(self.converged)),
+                'iterations': {'mean': float(np.mean(self.iterations)) if self.iterations.size else 0.0,
+                               'max': int(np.max(self.iterations)) if self.iterations.size else 0},
+                'evaluations': self.evaluations, 'elapsed': self.elapsed}
+
+    def __repr__(self):
+        return 'SolverResult(%d points, %d converged, %d evaluations, %.3f s)' % (
+            self.converged.size, np.count_nonzero(self.converged), self.evaluations, self.elapsed)
+
+# the compiled, vectorized function of the expression (and its derivative) for a solver, with variable as
+# its first argument; returns it together with the values of the other variables taken from bindings
+def _solver_function(expression, variable, bindings, derivative):
+    others = sorted(expression.free_variables() - frozenset([variable]))
+    for name in others:
+        if name not in bindings:
+            raise ValueError('Variable %s is not bound' % name)
+    variables = (variable,) + tuple(others)
+    key = (expression, variables, 'with derivative' if derivative else 'solver')
+    function = _compile_cache.get(key)
+    if function is None:
+        if derivative:
+            function = _compile([expression, expression.derivative(variable)], variables, True, many=True)
+        else:
+            function = _compile([expression], variables, True)
+        _compile_cache.put(key, function)
+    return function, [bindings[name] for name in others]
+
+# the points (the arrays given for them broadcast against the values of the other variables) as flat arrays,
+# their shape, and the values of the other variables: numbers, or flat arrays with a value per point
+def _solver_points(arrays, values):
+    arrays = [np.asarray(array, dtype=float) for array in arrays]
+    values = [np.asarray(value, dtype=float) for value in values]
+    shape = np.broadcast_shapes(*[array.shape for array in arrays + values])
+    points = [np.broadcast_to(array, shape).ravel().copy() for array in arrays]
+    arguments = [np.broadcast_to(value, shape).ravel() if value.ndim else float(value) for value in values]
+    return points, shape, arguments
+
+# the arguments of the points with the given indices
+def _select(arguments, indices):
+    return [value[indices] if isinstance(value, np.ndarray) else value for value in arguments]
+
+def _newton(expression, variable, starts, bindings, tol, maxiter):
+    start = time.perf_counter()
+    function, values = _solver_function(expression, variable, bindings, True)
+    (x,), shape, arguments = _solver_points([starts], values)
+    iterations = np.zeros(x.size, dtype=int)
+    converged = np.zeros(x.size, dtype=bool)
+    # the points that are still iterating
+    active = np.arange(x.size)
+    evaluations = 0
+    with np.errstate(all='ignore'):
+        for i in range(maxiter):
+            if not active.size:
+                break
+            point = x[active]
+            value, slope = function(point, *_select(arguments, active))
+            evaluations += active.size
+            step = np.where(value == 0, 0.0, value / slope)
+            new = point - step
+            iterations[active] += 1
+            # a point where the derivative vanishes (or overflows) stops where it is, unconverged
+            finite = np.isfinite(new)
+            x[active] = np.where(finite, new, point)
+            done = finite & (np.abs(step) <= tol * (1 + np.abs(new)))
+            converged[active[done]] = True
+            active = active[finite & ~done]
+        residual = np.abs(function(x, *arguments)[0]) if x.size else np.zeros(0)
+    return SolverResult(x.reshape(shape), converged.reshape(shape), iterations.reshape(shape),
+                        residual.reshape(shape), evaluations + x.size, time.perf_counter() - start)
+
+def _find_root(expression, variable, lower, upper, bindings, tol, maxiter):
+    start = time.perf_counter()
+    function, values = _solver_function(expression, variable, bindings, True)
+    (low, high), shape, arguments = _solver_points([lower, upper], values)
+    iterations = np.zeros(low.size, dtype=int)
+    with np.errstate(all='ignore'):
+        f_low = function(low, *arguments)[0]
+        f_high = function(high, *arguments)[0]
+        # turn every interval around so that f(low) <= 0 <= f(high); low may then be the upper end
+        swap = f_low > 0
+        low[swap], high[swap] = high[swap], low[swap].copy()
+        f_low, f_high = np.where(swap, f_high, f_low), np.where(swap, f_low, f_high)
+        valid = (f_low <= 0) & (f_high >= 0)
+        converged = valid & ((f_low == 0) | (f_high == 0))
+        x = np.where(f_low == 0, low, np.where(f_high == 0, high, (low + high) / 2))
+        x[~valid] = np.nan
+        active = np.flatnonzero(valid & ~converged)
+        evaluations = 2 * low.size
+        for i in range(maxiter):
+            if not active.size:
+                break
+            point = x[active]
+            value, slope = function(point, *_select(arguments, active))
+            evaluations += active.size
+            iterations[active] += 1
+            # shrink the interval around the root, then step by Newton if that stays inside it
+            below = value < 0
+            low[active[below]] = point[below]
+            high[active[~below]] = point[~below]
+            a, b = low[active], high[active]
+            step = value / slope
+            new = point - step
+            # a Newton step within the tolerance has converged; point is an end of the interval by now,
+            # so new may not lie strictly inside it (it is point itself when the step is below one ulp)
+            close = np.isfinite(step) & (np.abs(step) <= tol * (1 + np.abs(point)))
+            inside = np.isfinite(new) & (new > np.minimum(a, b)) & (new < np.maximum(a, b))
+            new = np.where(inside | close, new, (a + b) / 2)
+            done = (value == 0) | close | (np.abs(b - a) <= tol * (1 + np.abs(new)))
+            x[active] = np.where(value == 0, point, new)
+            converged[active[done]] = True
+            active = active[~done]
+        residual = np.abs(function(x, *arguments)[0]) if x.size else np.zeros(0)
+    return SolverResult(x.reshape(shape), converged.reshape(shape), iterations.reshape(shape),
+                        residual.reshape(shape), evaluations + x.size, time.perf_counter() - start)
+
+# the 15-point Gauss-Kronrod rule on [-1, 1]: the nodes, the Kronrod weights, and the weights of the
+# 7-point Gauss rule on every other node; the difference of both estimates is the error estimate
+_KRONROD_NODES = [0.991455371120812639206854697526329, 0.949107912342758524526189684047851,
+                  0.864864423359769072789712788640926, 0.741531185599394439863864773280788,
+                  0.586087235467691130294144845693013, 0.405845151377397166906606412076961,
+                  0.207784955007898467600689403773245, 0.0]
+_KRONROD_WEIGHTS = [0.022935322010529224963732008058970, 0.063092092629978553290700663189204,
+                    0.104790010322250183839876322541518, 0.140653259715525918745189590510238,
+                    0.169004726639267902826583426598550, 0.190350578064785409913256402421014,
+                    0.204432940075298892414161999234649, 0.209482141084727828012999174891714]
+_GAUSS_WEIGHTS = [0.129484966168869693270611432679082, 0.279705391489276667901467771423780,
+                  0.381830050505118944950369775488975, 0.417959183673469387755102040816327]
+
+def _integrate(expression, variable, lower, upper, bindings, tol, rtol, maxiter):
+    start = time.perf_counter()
+    function, values = _solver_function(expression, variable, bindings, False)
+    nodes = np.array([-x for x in _KRONROD_NODES[:-1]] + _KRONROD_NODES[::-1])
+    kronrod = np.array(_KRONROD_WEIGHTS[:-1] + _KRONROD_WEIGHTS[::-1])
+    gauss = np.zeros(15)
+    gauss[1::2] = _GAUSS_WEIGHTS[:-1] + [_GAUSS_WEIGHTS[-1]] + _GAUSS_WEIGHTS[-2::-1]
+    (low, high), shape, arguments = _solver_points([lower, upper], values)
+    total = np.zeros(low.size)
+    error = np.zeros(low.size)
+    iterations = np.zeros(low.size, dtype=int)
+    converged = np.ones(low.size, dtype=bool)
+    width = np.abs(high - low)
+    # the pieces still to be integrated, and the integral each one belongs to
+    a = low
+    b = high
+    owner = np.arange(low.size)
+    evaluations = 0
+    with np.errstate(all='ignore'):
+        for i in range(maxiter):
+            if not owner.size:
+                break
+            center = (a + b) / 2
+            half = (b - a) / 2
+            points = center[:, None] + half[:, None] * nodes
+            samples = function(points, *[value[:, None] if isinstance(value, np.ndarray) else value
+                                         for value in _select(arguments, owner)])
+            evaluations += points.size
+            estimate = half * samples.dot(kronrod)
+            difference = np.abs(estimate - half * samples.dot(gauss))
+            iterations[owner] = i + 1
+            # an integral is done once its total error estimate is small enough; until then, every piece
+            # is done once its error is within its share (by length) of the absolute tolerance
+            pending = np.bincount(owner, difference, total.size)
+            done = error + pending <= np.maximum(tol, rtol * np.abs(total + np.bincount(owner, estimate, total.size)))
+            share = np.abs(b - a) / np.where(width[owner] > 0, width[owner], 1)
+            accept = (difference <= np.maximum(tol * share, rtol * np.abs(estimate))) | done[owner] | \
+                     ~np.isfinite(difference)
+            if i == maxiter - 1:
+                converged[owner[~accept]] = False
+                accept[:] = True
+            converged[owner[~np.isfinite(difference)]] = False
+            np.add.at(total, owner[accept], estimate[accept])
+            np.add.at(error, owner[accept], difference[accept])
+            split = ~accept
+            a, b = np.concatenate([a[split], center[split]]), np.concatenate([center[split], b[split]])
+            owner = np.concatenate([owner[split], owner[split]])
+    return SolverResult(total.reshape(shape), converged.reshape(shape), iterations.reshape(shape),
+                        error.reshape(shape), evaluations, time.perf_counter() - start)
+
+
+class Polynomial():
+    """A polynomial stored as a sparse dictionary from exponent tuples to coefficients"""
+    # atoms are the variables of the polynomial: Variables, or subtrees that aren't polynomial themselves
+    # (like sin(x) or x**y), in the order in which they were added. terms maps the exponents of the atoms
+    # of a monomial, as a tuple without trailing zeros, onto its coefficient; e.g. with atoms [x, y],
+    # {(2, 1): 3, (): -1} is 3*x**2*y - 1. New atoms go at the end, so existing keys stay valid.
+    def __init__(self, terms=None, atoms=None):
+        self.terms = {} if terms is None else terms
+        self.atoms = [] if atoms is None else list(atoms)
+        self.index = dict((atom, i) for i, atom in enumerate(self.atoms))
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __str__(self):
+        return str(self.toExpression())
+
+    def __eq__(self, other):
+        if not isinstance(other, Polynomial):
+            return False
+        return self._canonical() == other._canonical()
+
+    # the terms keyed on the atoms themselves, independent of the order of the atoms
+    def _canonical(self):
+        return dict((frozenset((self.atoms[i], e) for i, e in enumerate(exponents) if e), coefficient)
+                    for exponents, coefficient in self.terms.items())
+
+    def copy(self):
+        return Polynomial(dict(self.terms), self.atoms)
+
+    def degree(self):
+        return max([sum(exponents) for exponents in self.terms] or [0])
+
+    # the polynomial of a constant or an atom
+    def constant(value):
+        return Polynomial({(): value} if value != 0 else {})
+
+    def atom(expression):
+        return Polynomial({(1,): 1}, [expression])
+
+    # for every atom of other, its position in self (added when self doesn't have it yet)
+    def _positions(self, other):
+        positions = []
+        for atom in other.atoms:
+            position = self.index.get(atom)
+            if position is None:
+                position = self.index[atom] = len(self.atoms)
+                self.atoms.append(atom)
+            positions.append(position)
+        return positions
+
+    # the key in self of a monomial of other
+    def _key(self, exponents, positions):
+        if positions == list(range(len(positions))):
+            return exponents
+        key = [0] * (max(positions[:len(exponents)] or [-1]) + 1)
+        for position, exponent in zip(positions, exponents):
+            key[position] = exponent
+        while key and not key[-1]:
+            key.pop()
+        return tuple(key)
+
+    # self += factor * other, in time linear in the size of other
+    def _add_in_place(self, other, factor=1):
+        positions = self._positions(other)
+        terms = self.terms
+        for exponents, coefficient in other.terms.items():
+            key = self._key(exponents, positions)
+            total = terms.get(key, 0) + factor * coefficient
+            if total == 0:
+                terms.pop(key, None)
+            else:
+                terms[key] = total
+        return self
+
+    def _scale_in_place(self, factor):
+        if factor == 0:
+            self.terms = {}
+        else:
+            for exponents in self.terms:
+                self.terms[exponents] *= factor
+        return self
+
+    def __add__(self, other):
+        return self.copy()._add_in_place(_as_polynomial(other))
+
+    def __radd__(self, other):
+        return _as_polynomial(other).copy()._add_in_place(self)
+
+    def __sub__(self, other):
+        return self.copy()._add_in_place(_as_polynomial(other), -1)
+
+    def __rsub__(self, other):
+        return _as_polynomial(other).copy()._add_in_place(self, -1)
+
+    def __neg__(self):
+        return self.copy()._scale_in_place(-1)
+
+    def __mul__(self, other):
+        other = _as_polynomial(other)
+        result = Polynomial({}, self.atoms)
+        positions = result._positions(other)
+        terms = result.terms
+        for exponents, coefficient in other.terms.items():
+            key = result._key(exponents, positions)
+            for own, own_coefficient in self.terms.items():
+                # exponent tuples of different length: the missing exponents are zero
+                if len(own) < len(key):
+                    product = tuple(map(operator.add, own, key)) + key[len(own):]
+                else:
+                    product = tuple(map(operator.add, own, key)) + own[len(key):]
+                total = terms.get(product, 0) + own_coefficient * coefficient
+                if total == 0:
+                    terms.pop(product, None)
+                else:
+                    terms[product] = total
+        return result
+
+    def __rmul__(self, other):
+        return self * other
+
+    # integer powers n >= 0, by repeated squaring
+    def __pow__(self, n):
+        if not isinstance(n, int) or n < 0:
+            raise ValueError('A polynomial can only be raised to a non-negative integer power')
+        result = Polynomial.constant(1)
+        base = self
+        while n:
+            if n & 1:
+                result = result * base
+            n >>= 1
+            if n:
+                base = base * base
+        return result
+
+    # the polynomial of an expression: sums, differences, products, negations, integer powers and
+    # divisions by constants are multiplied out, other nodes become atoms (with their operands expanded)
+    def fromExpression(expression):
+        def visit(node, operands):
+            cls = type(node)
+            if cls == Constant:
+                return Polynomial.constant(node.value)
+            elif cls == Variable:
+                return Polynomial.atom(node)
+            elif cls == AddNode:
+                # the operands were made for this node only, so they can be changed in place
+                return operands[0]._add_in_place(operands[1])
+            elif cls == SubNode:
+                return operands[0]._add_in_place(operands[1], -1)
+            elif cls == NegNode:
+                return operands[0]._scale_in_place(-1)
+            elif cls == MulNode:
+                if _constant_value(operands[1]) is not None:
+                    return operands[0]._scale_in_place(_constant_value(operands[1]))
+                elif _constant_value(operands[0]) is not None:
+                    return operands[1]._scale_in_place(_constant_value(operands[0]))
+                return operands[0] * operands[1]
+            elif cls == DivNode and _constant_value(operands[1]):
+                return operands[0]._scale_in_place(1 / _constant_value(operands[1]))
+            elif cls == PowNode and isinstance(_constant_value(operands[1]), int) and _constant_value(operands[1]) >= 0:
+                return operands[0] ** _constant_value(operands[1])
+            return Polynomial.atom(node.rebuild([operand.toExpression() for operand in operands]))
+        return postorder(expression, visit)
+
+    # the expression of the polynomial, terms of the highest degree first
+    def toExpression(self):
+        order = sorted(range(len(self.atoms)), key=lambda i: _atom_order(self.atoms[i]))
+        def monomial_order(exponents):
+            padded = [exponents[i] if i < len(exponents) else 0 for i in order]
+            return [-sum(exponents)] + [-e for e in padded]
+        result = None
+        for exponents in sorted(self.terms, key=monomial_order):
+            coefficient = self.terms[exponents]
+            factors = None
+            for i in order:
+                if i < len(exponents) and exponents[i]:
+                    factor = self.atoms[i] if exponents[i] == 1 else PowNode(self.atoms[i], Constant(exponents[i]))
+                    factors = factor if factors is None else MulNode(factors, factor)
+            negative = coefficient < 0 and result is not None
+            if negative:
+                coefficient = -coefficient
+            if factors is None:
+                term = Constant(coefficient)
+            elif coefficient == 1:
+                term = factors
+            elif coefficient == -1:
+                term = NegNode(factors)
+            else:
+                term = MulNode(Constant(coefficient), factors)
+            if result is None:
+                result = term
+            elif negative:
+                result = SubNode(result, term)
+            else:
+                result = AddNode(result, term)
+        return Constant(0) if result is None else result
+
+# numbers can be combined with polynomials
+def _as_polynomial(value):
+    if isinstance(value, Polynomial):
+        return value
+    return Polynomial.constant(value)
+
+# the value of a constant polynomial, None when it depends on an atom
+def _constant_value(polynomial):
+    if not polynomial.terms:
+        return 0
+    if len(polynomial.terms) == 1 and () in polynomial.terms:
+        return polynomial.terms[()]
+    return None
+
+# atoms are written in the order: variables by name, then other subtrees
+def _atom_order(atom):
+    return (not isinstance(atom, Variable), str(atom))
+
+
+# node classes in an ExpressionDAG, the opcode of a node is the index of its class in this list
+_DAG_OPCODES = [Constant, Variable, AddNode, SubNode, MulNode, DivNode, PowNode,
+                NegNode, CosNode, SinNode, TanNode, LogNode, FunctionNode]
+_DAG_OPCODE_OF = dict((cls, opcode) for opcode, cls in enumerate(_DAG_OPCODES))
+_LEAF_OPCODES = (_DAG_OPCODE_OF[Constant], _DAG_OPCODE_OF[Variable])
+_FUNCTION_OPCODE = _DAG_OPCODE_OF[FunctionNode]
+
+class ExpressionDAG():
+    """A flat representation of one or more expressions, with equal subtrees stored once"""
+    # node i has opcode opcodes[i] and children lhs[i] and rhs[i] (indices of earlier nodes, -1 if absent);
+    # a Constant stores the index of its value in constants in lhs, a Variable the index of its name in symbols,
+    # and a FunctionNode the index of its name in rhs. roots holds the nodes of the expressions themselves.
+    # Building the DAG is common-subexpression elimination: a subtree that occurs more than once, in one
+    # expression or in several (like the derivatives of a gradient), becomes a single node.
+    def __init__(self, many=False):
+        self.opcodes = array.array('B')
+        self.lhs = array.array('l')
+        self.rhs = array.array('l')
+        self.roots = array.array('l')
+        self.constants = []
+        self.symbols = []
+        # made by fromExpressions: evaluate and compile give a value per root
+        self.many = many
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def __str__(self):
+        return ', '.join(str(expression) for expression in self.toExpressions())
+
+    # the DAG of an expression
+    def fromExpression(expression):
+        dag = ExpressionDAG()
+        dag._add_roots([expression])
+        return dag
+
+    # the DAG of a list of expressions, sharing the subtrees they have in common
+    def fromExpressions(expressions):
+        dag = ExpressionDAG(many=True)
+        dag._add_roots(expressions)
+        return dag
+
+    def _add_roots(self, expressions):
+        # index of every node (by identity) and of every (opcode, lhs, rhs) already stored
+        indices = {}
+        nodes = {}
+        constants = {}
+        symbols = {}
+        def pool(values, table, key, value):
+            if key not in table:
+                table[key] = len(values)
+                values.append(value)
+            return table[key]
+        def visit(node, operands):
+            cls = type(node)
+            opcode = _DAG_OPCODE_OF[cls]
+            if len(operands) == 2:
+                lhs, rhs = operands
+            elif cls == FunctionNode:
+                lhs, rhs = operands[0], pool(self.symbols, symbols, node.op_symbol, node.op_symbol)
+            elif operands:
+                lhs, rhs = operands[0], -1
+            elif cls == Constant:
+                lhs, rhs = pool(self.constants, constants, (type(node.value), node.value), node.value), -1
+            else:
+                lhs, rhs = pool(self.symbols, symbols, node.value, node.value), -1
+            key = (opcode, lhs, rhs)
+            if key not in nodes:
+                nodes[key] = len(self.opcodes)
+                self.opcodes.append(opcode)
+                self.lhs.append(lhs)
+                self.rhs.append(rhs)
+            indices[id(node)] = nodes[key]
+            return nodes[key]
+        for expression in expressions:
+            self.roots.append(postorder(expression, visit, lambda node: indices.get(id(node))))
+
+    # the object tree of the (first) expression, shared subtrees become shared nodes
+    def toExpression(self):
+        return self.toExpressions()[0]
+
+    # the object trees of all expressions, sharing nodes between them
+    def toExpressions(self):
+        nodes = []
+        for opcode, lhs, rhs in zip(self.opcodes, self.lhs, self.rhs):
+            cls = _DAG_OPCODES[opcode]
+            if cls == Constant:
+                nodes.append(Constant(self.constants[lhs]))
+            elif cls == Variable:
+                nodes.append(Variable(self.symbols[lhs]))
+            elif cls == FunctionNode:
+                nodes.append(FunctionNode(self.symbols[rhs], nodes[lhs]))
+            elif issubclass(cls, BinaryNode):
+                nodes.append(cls(nodes[lhs], nodes[rhs]))
+            else:
+                nodes.append(cls(nodes[lhs]))
+        return [nodes[root] for root in self.roots]
+
+    # the value of the expression with the variables bound in dictionary, or a list with the value of
+    # every expression for a DAG made by fromExpressions; every shared node is computed once.
+    # With NumPy arrays as values the whole computation is done on arrays
+    def evaluate(self, dictionary={}):
+        vectorized = any(_is_array(value) for value in dictionary.values())
+        module = np if vectorized else math
+        values = []
+        for opcode, lhs, rhs in zip(self.opcodes, self.lhs, self.rhs):
+            cls = _DAG_OPCODES[opcode]
+            if cls == Constant:
+                values.append(self.constants[lhs])
+            elif cls == Variable:
+                name = str(self.symbols[lhs])
+                if name not in dictionary:
+                    raise ValueError('Variable %s is not bound' % name)
+                values.append(dictionary[name])
+            elif cls == FunctionNode:
+                raise ValueError('Unknown function %s can not be evaluated' % self.symbols[rhs])
+            elif issubclass(cls, BinaryNode):
+                values.append(_BINARY_OPERATORS[cls.op_symbol](values[lhs], values[rhs]))
+            elif cls == NegNode:
+                values.append(-values[lhs])
+            else:
+                values.append(getattr(module, cls.op_symbol)(values[lhs]))
+        if self.many:
+            return [values[root] for root in self.roots]
+        return values[self.roots[0]]
+
+    # a Python function of the given variables computing the expression, or a tuple with all expressions
+    # for a DAG made by fromExpressions, in which every shared node is computed once; see Expression.compile
+    def compile(self, variables, vectorized=False):
+        return _compile(self.toExpressions(), tuple(str(v) for v in variables), vectorized, self.many)
+
+
+# binary format of Expression.to_bytes, version 1. Numbers are unsigned LEB128 varints (7 bits per byte,
+# lowest first, the high bit set on all but the last byte) unless a struct format is given:
+#   header     b'SX', the version (B), the number of constants and the number of symbols
+#   constants  a tag (B) and the value: 0 an int, zigzag encoded (0, -1, 1, -2, ... become 0, 1, 2, 3, ...),
+#              1 a float64 (<d), 2 a Fraction as its zigzag encoded numerator and its denominator
+#   symbols    the length and UTF-8 text of the names of the variables and functions
+#   nodes      the tree in prefix order: an opcode (B, the index in _DAG_OPCODES), followed by the pool
+#              index for Constant and Variable and the symbol index for FunctionNode, and then the operands.
+#              Every node that is read completely (after its operands) gets the next number, starting at 0;
+#              opcode 255 followed by a number repeats that node, so shared subtrees are stored once.
+_FORMAT_MAGIC = b'SX'
+_FORMAT_VERSION = 1
+_BACK_REFERENCE = 255
+_HEADER = struct.Struct('<2sB')
+_FLOAT64 = struct.Struct('<d')
+
+def _write_varint(output, value):
+    while value >= 0x80:
+        output.append(value & 0x7f | 0x80)
+        value >>= 7
+    output.append(value)
+
+# the varint at offset in view, and the offset after it
+def _read_varint(view, offset):
+    byte = view[offset]
+    if byte < 0x80:
+        return byte, offset + 1
+    value = 0
+    shift = 0
+    while True:
+        byte = view[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+def _zigzag(value):
+    return 2 * value if value >= 0 else -2 * value - 1
+
+def _unzigzag(value):
+    return value >> 1 if value & 1 == 0 else -(value >> 1) - 1
+
+def _to_bytes(expression):
+    dag = ExpressionDAG.fromExpression(expression)
+    output = bytearray(_HEADER.pack(_FORMAT_MAGIC, _FORMAT_VERSION))
+    _write_varint(output, len(dag.constants))
+    _write_varint(output, len(dag.symbols))
+    for value in dag.constants:
+        if isinstance(value, float):
+            output.append(1)
+            output += _FLOAT64.pack(value)
+        elif isinstance(value, int):
+            output.append(0)
+            _write_varint(output, _zigzag(value))
+        elif isinstance(value, fractions.Fraction):
+            output.append(2)
+            _write_varint(output, _zigzag(value.numerator))
+            _write_varint(output, value.denominator)
+        else:
+            raise ValueError('A constant of type %s can not be serialized' % type(value).__name__)
+    for symbol in dag.symbols:
+        text = str(symbol).encode('utf-8')
+        _write_varint(output, len(text))
+        output += text
+    # walk the DAG in prefix order, a node that was written before is written as a back reference
+    numbers = {}
+    stack = [(dag.roots[0], False)]
+    while stack:
+        index, expanded = stack.pop()
+        if expanded:
+            numbers[index] = len(numbers)
+            continue
+        if index in numbers:
+            output.append(_BACK_REFERENCE)
+            _write_varint(output, numbers[index])
+            continue
+        opcode, lhs, rhs = dag.opcodes[index], dag.lhs[index], dag.rhs[index]
+        output.append(opcode)
+        if rhs < 0 and opcode in _LEAF_OPCODES:
+            _write_varint(output, lhs)
+            numbers[index] = len(numbers)
+        elif opcode == _FUNCTION_OPCODE:
+            _write_varint(output, rhs)
+            stack += [(index, True), (lhs, False)]
+        elif rhs >= 0:
+            stack += [(index, True), (rhs, False), (lhs, False)]
+        else:
+            stack += [(index, True), (lhs, False)]
+    return bytes(output)
+
+def _from_bytes(data, offset=0):
+    view = memoryview(data)
+    magic, version = _HEADER.unpack_from(view, offset)
+    if magic != _FORMAT_MAGIC:
+        raise ValueError('Not a serialized expression')
+    if version != _FORMAT_VERSION:
+        raise ValueError('Unsupported format version %d' % version)
+    constant_count, offset = _read_varint(view, offset + _HEADER.size)
+    symbol_count, offset = _read_varint(view, offset)
+    constants = []
+    for i in range(constant_count):
+        tag = view[offset]
+        if tag == 0:
+            value, offset = _read_varint(view, offset + 1)
+            constants.append(_unzigzag(value))
+        elif tag == 1:
+            constants.append(_FLOAT64.unpack_from(view, offset + 1)[0])
+            offset += 1 + _FLOAT64.size
+        elif tag == 2:
+            numerator, offset = _read_varint(view, offset + 1)
+            denominator, offset = _read_varint(view, offset)
+            constants.append(fractions.Fraction(_unzigzag(numerator), denominator))
+        else:
+            raise ValueError('Unknown constant tag %d' % tag)
+    symbols = []
+    for i in range(symbol_count):
+        length, offset = _read_varint(view, offset)
+        if offset + length > len(view):
+            raise IndexError('symbol past the end of the data')
+        symbols.append(str(view[offset:offset + length], 'utf-8'))
+        offset += length
+    # nodes holds the numbered nodes, stack the nodes still waiting for operands as [class, name, operands]
+    nodes = []
+    stack = []
+    while True:
+        opcode = view[offset]
+        if opcode == _BACK_REFERENCE:
+            number, offset = _read_varint(view, offset + 1)
+            node = nodes[number]
+        else:
+            cls = _DAG_OPCODES[opcode]
+            if cls is Constant or cls is Variable:
+                index, offset = _read_varint(view, offset + 1)
+                node = Constant(constants[index]) if cls is Constant else Variable(symbols[index])
+                nodes.append(node)
+            else:
+                name = None
+                if cls is FunctionNode:
+                    index, offset = _read_varint(view, offset + 1)
+                    name = symbols[index]
+                else:
+                    offset += 1
+                stack.append([cls, name, []])
+                continue
+        # hand the finished node to the nodes waiting for it
+        while stack:
+            cls, name, operands = stack[-1]
+            operands.append(node)
+            if len(operands) < (2 if issubclass(cls, BinaryNode) else 1):
+                break
+            stack.pop()
+            if cls is FunctionNode:
+                node = FunctionNode(name, operands[0])
+            else:
+                node = cls(*operands)
+            nodes.append(node)
+        else:
+            return node
+
+
+class ResultCache():
+    """A persistent cache of simplify and derivative results in an SQLite file, evicting the least recently used"""
+    # results are stored in the format of to_bytes, under the SHA-256 of the operation, the variable and
+    # the encoded input tree, which (unlike hash()) is the same in every run of the program
+    def __init__(self, path, maxsize=100000):
+        self.path = path
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.connection = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # the connection of this process, a process made by fork opens its own
+    def _connect(self):
+        if self.connection is None or self.pid != os.getpid():
+            import sqlite3
+            self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self.pid = os.getpid()
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS results '
+                                    '(key BLOB PRIMARY KEY, result BLOB NOT NULL, used INTEGER NOT NULL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+            self.clock = self.connection.execute('SELECT COALESCE(MAX(used), 0) FROM results').fetchone()[0]
+            # the number of entries, kept up to date by put so it doesn't have to count them every time
+            self.size = self.connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        return self.connection
+
+    # the key of an operation on expression, raises ValueError when expression can't be encoded
+    def key(self, operation, expression, variable=None):
+        import hashlib
+        prefix = ('%s\0%s\0' % (operation, '' if variable is None else variable)).encode('utf-8')
+        return hashlib.sha256(prefix + expression.to_bytes()).digest()
+
+    def __len__(self):
+        with self.lock:
+            return self._connect().execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    # returns default when the key is not in the cache
+    def get(self, key, default=None):
+        if self.maxsize <= 0:
+            return default
+        with self.lock:
+            connection = self._connect()
+            row = connection.execute('SELECT result FROM results WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                try:
+                    value = Expression.from_bytes(row[0])
+                except ValueError:
+                    # written in another format version, drop it
+                    connection.execute('DELETE FROM results WHERE key = ?', (key,))
+                    row = None
+            if row is None:
+                self.misses += 1
+                return default
+            self.clock += 1
+            connection.execute('UPDATE results SET used = ? WHERE key = ?', (self.clock, key))
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        data = value.to_bytes()
+        with self.lock:
+            connection = self._connect()
+            self.clock += 1
+            cursor = connection.execute('UPDATE results SET result = ?, used = ? WHERE key = ?', (data, self.clock, key))
+            if cursor.rowcount == 0:
+                connection.execute('INSERT OR REPLACE INTO results (key, result, used) VALUES (?, ?, ?)',
+                                   (key, data, self.clock))
+                self.size += 1
+                if self.size > self.maxsize:
+                    self._evict(connection)
+
+    # change the maximum number of entries, a maxsize of 0 switches the cache off
+    def resize(self, maxsize):
+        with self.lock:
+            self.maxsize = maxsize
+            self._evict(self._connect())
+
+    def _evict(self, connection):
+        # count again, other processes may have added entries as well
+        self.size = connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        excess = self.size - max(self.maxsize, 0)
+        if excess > 0:
+            connection.execute('DELETE FROM results WHERE key IN '
+                               '(SELECT key FROM results ORDER BY used LIMIT ?)', (excess,))
+            self.evictions += excess
+            self.size -= excess
+
+    def clear(self):
+        with self.lock:
+            self._connect().execute('DELETE FROM results')
+            self.size = 0
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def stats(self):
+        with self.lock:
+            size = self._connect().execute('SELECT COUNT(*) FROM results').fetchone()[0]
+            return {'size': size, 'maxsize': self.maxsize, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+# the ResultCache used by top level calls of Expression.simplify and Expression.derivative, None for no cache;
+# e.g. Symbolische_manipulatie.result_cache = ResultCache('results.sqlite')
+result_cache = None
+
+# the result of compute(), taken from result_cache when it holds the operation on expression
+def _cached_result(operation, expression, variable, compute):
+    cache = result_cache
+    if cache is None:
+        return compute()
+    try:
+        key = cache.key(operation, expression, variable)
+    except ValueError:
+        # a constant that can't be encoded, the result isn't cached
+        return compute()
+    result = cache.get(key)
+    if result is None:
+        result = compute()
+        try:
+            cache.put(key, result)
+        except ValueError:
+            pass
+    return result
+
+
+class BatchFailure():
+    """The result of an item of simplify_many or derivative_many that raised an exception"""
+    def __init__(self, index, error):
+        self.index = index
+        self.error_type = type(error).__name__
+        self.message = str(error)
+
+    def __str__(self):
+        return '%s: %s' % (self.error_type, self.message)
+
+    def __repr__(self):
+        return 'BatchFailure(%d, %s)' % (self.index, self)
+
+# simplify every expression (or formula string) of expressions, divided over a pool of worker processes.
+# Returns a list in the order of expressions, with a BatchFailure for every item that failed.
+# workers=None uses a process per CPU, workers=1 does all the work in this process.
+def simplify_many(expressions, workers=None, chunksize=64):
+    return _map_batch('simplify', None, expressions, workers, chunksize)
+
+# the derivative of every expression (or formula string) of expressions with respect to variable,
+# divided over worker processes like simplify_many
+def derivative_many(expressions, variable, workers=None, chunksize=64):
+    return _map_batch('derivative', str(_as_variable(variable).value), expressions, workers, chunksize)
+
+# expressions are sent to and from the workers in the format of to_bytes instead of as a pickled
+# object graph, which is smaller and doesn't hit the recursion limit of pickle on deep trees.
+# An item that can't be encoded fails on its own, it is sent as None and its BatchFailure kept here
+def _map_batch(operation, variable, expressions, workers, chunksize):
+    items = []
+    failures = {}
+    for index, item in enumerate(expressions):
+        if isinstance(item, str):
+            items.append(item)
+            continue
+        try:
+            # not item.to_bytes(), that of an int would be sent to the workers as well
+            items.append(Expression.to_bytes(item))
+        except Exception as error:
+            failures[index] = BatchFailure(index, error)
+            items.append(None)
+    chunks = [(operation, variable, start, items[start:start + chunksize])
+              for start in range(0, len(items), chunksize)]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(chunks) <= 1:
+        results = map(_batch_chunk, chunks)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(min(workers, len(chunks))) as executor:
+            results = list(executor.map(_batch_chunk, chunks))
+    results = [result for chunk in results for result in chunk]
+    return [failures[index] if index in failures else result if isinstance(result, BatchFailure)
+            else Expression.from_bytes(result) for index, result in enumerate(results)]
+
+# the work of a worker process: apply operation to a chunk of items, starting at index start of the batch
+def _batch_chunk(arguments):
+    operation, variable, start, items = arguments
+    results = []
+    for index, item in enumerate(items, start):
+        if item is None:
+            results.append(None)
+            continue
+        try:
+            expression = Expression.fromString(item) if isinstance(item, str) else Expression.from_bytes(item)
+            if operation == 'simplify':
+                result = expression.simplify()
+            else:
+                result = expression.derivative(variable)
+            results.append(result.to_bytes())
+        except Exception as error:
+            results.append(BatchFailure(index, error))
+    return results
+
+
+# with this function, you plot a formula (an expression or a string). Call it with graph(function, range(-x, +x))
+# a formula of one variable is drawn as a line over the interval of x_range, one of two variables as a
+# surface over x_range and y_range (default: x_range). The plot is saved in filename (None: not saved) and
+# shown on screen when show is True; with show=False nothing but the figure and the file is made, so it
+# also works without a display. Returns the matplotlib Figure.
+def graph(formula, x_range, y_range=None, filename='Graph.pdf', show=True, samples=400, adaptive=True):
+    figure = _figure(show)
+    _plot(figure, formula, x_range, y_range, samples, adaptive)
+    if filename is not None:
+        figure.savefig(filename)
+    if show:
+        plt.show()
+    return figure
+
+# plot many formulas into one PDF file, one page per formula, without showing them; see graph
+def graph_pages(formulas, filename, x_range, y_range=None, samples=400, adaptive=True):
+    from matplotlib.backends.backend_pdf import PdfPages
+    with PdfPages(filename) as pdf:
+        for formula in formulas:
+            figure = _figure(False)
+            _plot(figure, formula, x_range, y_range, samples, adaptive)
+            pdf.savefig(figure)
+
+# a figure managed by pyplot when it is going to be shown, a stand-alone one otherwise (no GUI backend needed)
+def _figure(show):
+    if show:
+        return plt.figure()
+    from matplotlib.figure import Figure
+    return Figure()
+
+def _plot(figure, formula, x_range, y_range, samples, adaptive):
+    expression = Expression.fromString(formula) if isinstance(formula, str) else formula
+    variables = sorted(expression.free_variables())
+    if len(variables) > 2:
+        raise ValueError('Only formulas of one or two variables can be plotted, not of %s' % ', '.join(variables))
+    if not variables:
+        variables = ['x']
+    function = expression.compile(variables, vectorized=True)
+    low, high = _interval(x_range)
+    with np.errstate(all='ignore'):
+        if len(variables) == 1:
+            x, y = _samples(function, low, high, samples, adaptive)
+            axes = figure.add_subplot()
+            axes.plot(x, y)
+            axes.grid()
+            # near a pole, show the range of the rest of the function instead of the huge values at the pole
+            # (judged on evenly spaced points, the adaptive ones crowd around the pole)
+            finite = y[np.isfinite(y)]
+            even = function(np.linspace(low, high, samples))
+            even = even[np.isfinite(even)]
+            if even.size:
+                bottom, top = np.percentile(even, [5, 95])
+                margin = 0.25 * (top - bottom)
+                if margin > 0 and (finite.min() < bottom - 4 * margin or finite.max() > top + 4 * margin):
+                    axes.set_ylim(bottom - margin, top + margin)
+            axes.set_ylabel('f(%s)' % variables[0])
+        else:
+            # registers the 3d projection on older matplotlib versions
+            from mpl_toolkits.mplot3d import Axes3D
+            side = max(int(samples ** 0.5), 2)
+            x, y = np.meshgrid(np.linspace(low, high, side), np.linspace(*_interval(x_range if y_range is None else y_range), side))
+            z = function(x, y)
+            z[~np.isfinite(z)] = np.nan
+            axes = figure.add_subplot(projection='3d')
+            axes.plot_surface(x, y, z, cmap='viridis')
+            axes.set_ylabel(variables[1])
+            axes.set_zlabel('f(%s, %s)' % tuple(variables))
+    axes.set_xlabel(variables[0])
+    axes.set_title('Graph of %s' % expression)
+    return axes
+
+# the interval covered by a range, list or array of values, or a (low, high) pair
+def _interval(values):
+    values = np.asarray(list(values), dtype=float)
+    return float(values.min()), float(values.max())
+
+# points (x, function(x)) on [low, high]: samples evenly spaced ones, and with adaptive=True extra points
+# halfway the intervals in which the function changes by more than 1% of its range (steep parts, poles),
+# a few times over; every round evaluates all new points at once. Non-finite values become NaN (gaps).
+def _samples(function, low, high, samples, adaptive, rounds=8, limit=20000):
+    x = np.linspace(low, high, samples)
+    y = function(x)
+    for i in range(rounds if adaptive else 0):
+        # the range of the function without its extremes, so a pole doesn't hide everything else
+        finite = y[np.isfinite(y)]
+        scale = np.subtract(*np.percentile(finite, [95, 5])) if finite.size else 0.0
+        if scale == 0:
+            break
+        jumps = np.abs(np.diff(y))
+        steep = ~(jumps <= 0.01 * scale)
+        steep &= np.isfinite(y[:-1]) | np.isfinite(y[1:])
+        if not steep.any() or len(x) + steep.sum() > limit:
+            break
+        middle = (x[:-1][steep] + x[1:][steep]) / 2
+        x = np.concatenate([x, middle])
+        y = np.concatenate([y, function(middle)])
+        order = np.argsort(x, kind='mergesort')
+        x, y = x[order], y[order]
+    y = np.where(np.isfinite(y), y, np.nan)
+    return x, y
+
+
+# a binding NAME=VALUE from the command line, as (name, number)
+def _binding(text):
+    name, separator, value = text.partition('=')
+    if not separator or not name.strip():
+        raise ValueError('expected NAME=NUMBER, got %r' % text)
+    try:
+        return name.strip(), int(value)
+    except ValueError:
+        try:
+            return name.strip(), float(value)
+        except ValueError:
+            raise ValueError('expected NAME=NUMBER, got %r' % text)
+
+# the result of the pipeline selected by the command line options for one formula
+def _process(formula, options):
+    expression = Expression.fromString(formula)
+    if options.simplify:
+        expression = expression.simplify(exact=options.exact)
+    if options.derivative is not None:
+        expression = expression.derivative(options.derivative, exact=options.exact)
+    if options.evaluate:
+        expression = expression.evaluate(options.bindings, exact=options.exact)
+    return expression
+
+# command line tool: read formulas line by line and write one result line per formula, e.g.
+#     python Symbolische_manipulatie.py formulas.txt --derivative x --evaluate --bind x=2
+# lines are processed one at a time, so input of any size runs in constant memory.
+# A formula that fails gives an empty output line (so output lines match input lines) and a message on stderr.
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Parse, simplify, differentiate and evaluate formulas, one per line.')
+    parser.add_argument('input', nargs='?', type=argparse.FileType('r'), default='-',
+                        help='file with one formula per line (default: stdin)')
+    parser.add_argument('-o', '--output', type=argparse.FileType('w'), default='-',
+                        help='file to write the results to (default: stdout)')
+    parser.add_argument('-s', '--simplify', action='store_true', help='simplify every formula')
+    parser.add_argument('-d', '--derivative', metavar='VARIABLE', help='differentiate with respect to VARIABLE')
+    parser.add_argument('-e', '--evaluate', action='store_true', help='evaluate with the values given by --bind')
+    parser.add_argument('-b', '--bind', metavar='NAME=NUMBER', action='append', default=[],
+                        help='value of a variable for --evaluate, may be repeated')
+    parser.add_argument('-x', '--exact', action='store_true',
+                        help='compute with exact fractions instead of floats where possible')
+    parser.add_argument('-c', '--cache', metavar='FILE',
+                        help='keep simplify and derivative results in FILE and reuse them in later runs')
+    parser.add_argument('-t', '--target', choices=sorted(_EMIT_TARGETS), default='infix',
+                        help='write the results as infix text (default), Python or NumPy source, or LaTeX')
+    options = parser.parse_args(argv)
+    try:
+        options.bindings = dict(_binding(text) for text in options.bind)
+    except ValueError as error:
+        parser.error(str(error))
+
+    global result_cache
+    previous = result_cache
+    if options.cache is not None:
+        result_cache = ResultCache(options.cache)
+    try:
+        failures = 0
+        for number, line in enumerate(options.input, 1):
+            formula = line.strip()
+            result = ''
+            if formula:
+                try:
+                    result = _process(formula, options).emit(options.target)
+                except Exception as error:
+                    failures += 1
+                    sys.stderr.write('line %d: %s: %s\n' % (number, type(error).__name__, error))
+            options.output.write(result + '\n')
+        options.output.flush()
+    finally:
+        if result_cache is not previous:
+            result_cache.close()
+            result_cache = previous
+    return 1 if failures else 0
 
-# with this function, you plot a polynomial. Call it with graph(function, range(-x, +x))
-def graph(formula, x_range):
-    function = str(formula)
-    with PdfPages("Graph.pdf") as pdf:
-        x = np.array(x_range)
-        y = eval(function)
-        plt.plot(x, y)
-        plt.grid()
-        plt.xlabel('$X\ axis$')
-        plt.ylabel('$Y\ axis$')
-        plt.title('$Graph\ of\ \ $' + function)
-        plt.show()  
-        pdf.savefig()        
-    
\ No newline at end of file
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,610 @@
+#benchmarks for Symbolische_manipulatie, run with: python benchmark.py
+#the reproducible suite: python benchmark.py suite --output new.json, then python benchmark.py compare old.json new.json
+
+import json
+import mmap
+import os
+import pickle
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import Symbolische_manipulatie
+from Symbolische_manipulatie import Expression, ExpressionDAG, Variable, Constant, parse_cache, derivative_many, ResultCache, graph, graph_pages, profiling, SinNode, CosNode, TanNode, LogNode
+
+# a random formula of the given number of terms, using only syntax the old parser understands as well
+def random_formula(rng, terms):
+    parts = []
+    for i in range(terms):
+        factor = rng.choice(['x', 'y', 'z', str(rng.randint(1, 99)), '(a+%d)' % rng.randint(1, 9)])
+        power = rng.choice(['', '**2', '**3'])
+        parts.append('%d*%s%s' % (rng.randint(1, 20), factor, power))
+        parts.append(rng.choice(['+', '-']))
+    return ' '.join(parts[:-1])
+
+# compare the scanner based Expression.fromString with the original Shunting-yard parser
+def benchmark_parser(count=2000, terms=20, seed=0):
+    rng = random.Random(seed)
+    formulas = [random_formula(rng, terms) for i in range(count)]
+    print('parsing %d formulas of %d terms' % (count, terms))
+    timings = {}
+    # measure the parsers themselves, not the parse cache
+    maxsize = parse_cache.maxsize
+    parse_cache.resize(0)
+    try:
+        for name, parse in [('shunting-yard', Expression.fromStringShuntingYard), ('scanner', Expression.fromString)]:
+            start = time.perf_counter()
+            for formula in formulas:
+                parse(formula)
+            timings[name] = time.perf_counter() - start
+            print('  %-14s %8.1f us per formula' % (name, 1e6 * timings[name] / count))
+    finally:
+        parse_cache.resize(maxsize)
+    print('  speedup        %8.1fx' % (timings['shunting-yard'] / timings['scanner']))
+
+# parse a stream in which a small set of formulas repeats, as our input streams do
+def benchmark_parse_cache(count=20000, distinct=500, terms=20, seed=0):
+    rng = random.Random(seed)
+    formulas = [random_formula(rng, terms) for i in range(distinct)]
+    stream = [rng.choice(formulas) for i in range(count)]
+    parse_cache.clear()
+    before = parse_cache.stats()
+    start = time.perf_counter()
+    for formula in stream:
+        Expression.fromString(formula)
+    elapsed = time.perf_counter() - start
+    after = parse_cache.stats()
+    print('parsing %d formulas, %d distinct' % (count, distinct))
+    print('  %-14s %8.1f us per formula, %d hits, %d misses' % ('cached', 1e6 * elapsed / count,
+          after['hits'] - before['hits'], after['misses'] - before['misses']))
+
+# a left-deep sum of n terms, as produced by our code generator
+def deep_sum(n, variables=7):
+    tree = Variable('x0')
+    for i in range(1, n):
+        tree = tree + Constant(i % 5 + 1) * Variable('x%d' % (i % variables))
+    return tree
+
+# the terms of deep_sum(n, variables=n) in a right-deep sum, x0 + (t1 + (t2 + ...))
+def right_deep_sum(n):
+    tree = Constant((n - 1) % 5 + 1) * Variable('x%d' % (n - 1))
+    for i in range(n - 2, 0, -1):
+        tree = Constant(i % 5 + 1) * Variable('x%d' % i) + tree
+    return Variable('x0') + tree
+
+# the product of n distinct variables in a right-deep product, x0 * (x1 * (x2 * ...))
+def right_deep_product(n):
+    tree = Variable('x%d' % (n - 1))
+    for i in range(n - 2, -1, -1):
+        tree = Variable('x%d' % i) * tree
+    return tree
+
+# the terms of deep_sum(n, variables=n) in a balanced sum, added in pairs
+def balanced_sum(n):
+    level = [Variable('x0')] + [Constant(i % 5 + 1) * Variable('x%d' % i) for i in range(1, n)]
+    while len(level) > 1:
+        level = [level[i] + level[i + 1] if i + 1 < len(level) else level[i] for i in range(0, len(level), 2)]
+    return level[0]
+
+# the shapes of tree timed by benchmark_depth: a name, a function building the tree of a size, the variable
+# of the derivative, the sizes, and the largest size for which simplify and derivative are timed. Sums and
+# products with a distinct variable in every term, so that no terms combine and the memo table can't hide the
+# work, in all three shapes; and a product of factors (x + k), whose rewrites are nested about as deep as the
+# polynomial they expand to has terms
+DEPTH_SIZES = (1000, 10000, 100000, 1000000)
+DEPTH_SHAPES = [('left-deep sum', lambda n: deep_sum(n, variables=n), 'x1', DEPTH_SIZES, 10000),
+                ('right-deep sum', right_deep_sum, 'x1', DEPTH_SIZES, 10000),
+                ('balanced sum', balanced_sum, 'x1', DEPTH_SIZES, 10000),
+                ('right-deep product', right_deep_product, 'x1', DEPTH_SIZES, 10000),
+                ('wide product', lambda n: wide_product(random.Random(n), n), 'x', (10, 100, 1000, 100000), 100)]
+
+# time the tree operations on trees of every shape of increasing size; the last column is the simplify time
+# per term (or factor), which should stay about the same for all sizes of the sums and products of distinct variables
+def benchmark_depth(shapes=DEPTH_SHAPES):
+    for shape, build, variable, sizes, rewrite_limit in shapes:
+        print('%ss, seconds per operation' % shape)
+        print('  %8s %8s %8s %8s %8s %8s %8s %8s %8s' % ('terms', 'build', 'hash', 'str', 'eq', 'evaluate', 'simplify',
+                                                        'derive', 'us/term'))
+        for n in sizes:
+            timings = []
+            start = time.perf_counter()
+            tree = build(n)
+            timings.append(time.perf_counter() - start)
+            other = build(n)
+            bindings = dict((name, 1.5) for name in tree.free_variables())
+            operations = [lambda: hash(tree), lambda: str(tree), lambda: tree == other, lambda: tree.evaluate(bindings)]
+            if n <= rewrite_limit:
+                operations += [lambda: tree.simplify(), lambda: tree.derivative(variable)]
+            for operation in operations:
+                start = time.perf_counter()
+                operation()
+                timings.append(time.perf_counter() - start)
+            per_term = ' %8.1f' % (1e6 * timings[5] / n) if n <= rewrite_limit else ''
+            print('  %8d %s%s' % (n, ' '.join('%8.3f' % t for t in timings), per_term))
+
+# memory used by the object tree of a left-deep sum and by its ExpressionDAG
+def benchmark_memory(n=200000):
+    print('memory of a left-deep sum of %d terms' % n)
+    tracemalloc.start()
+    tree = deep_sum(n)
+    tree_size = tracemalloc.get_traced_memory()[0]
+    dag = ExpressionDAG.fromExpression(tree)
+    dag_size = tracemalloc.get_traced_memory()[0] - tree_size
+    tracemalloc.stop()
+    print('  %-14s %8.1f MB, %8.1f bytes per node' % ('object tree', tree_size / 1e6, tree_size / (4.0 * n)))
+    print('  %-14s %8.1f MB, %d nodes after sharing' % ('DAG', dag_size / 1e6, len(dag)))
+    bindings = dict(('x%d' % i, 1.5) for i in range(7))
+    for name, evaluate in [('tree', lambda: tree.evaluate(bindings)), ('DAG', lambda: dag.evaluate(bindings))]:
+        start = time.perf_counter()
+        evaluate()
+        print('  %-14s %8.3f s to evaluate' % (name, time.perf_counter() - start))
+
+# writing a left-deep sum as text: str against emit into a file, for each target; time and peak memory
+def benchmark_emit(n=200000):
+    tree = deep_sum(n)
+    str(tree)
+    print('writing a left-deep sum of %d terms' % n)
+    runs = [('str', lambda file: file.write(str(tree)))]
+    runs += [('emit %s' % target, lambda file, target=target: tree.emit(target, file))
+             for target in ['infix', 'python', 'numpy', 'latex']]
+    with tempfile.TemporaryFile('w') as file:
+        for name, run in runs:
+            start = time.perf_counter()
+            run(file)
+            elapsed = time.perf_counter() - start
+            tracemalloc.start()
+            run(file)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print('  %-14s %8.3f s %8.1f MB peak' % (name, elapsed, peak / 1e6))
+
+# the emitted Python and NumPy source must compute the same value as evaluate(), also where brackets
+# are needed between operators of equal precedence, like in nested powers and differences
+def check_emit(formulas=('(y**3)**2', '2**3**x', '(2**x)**3', '(x**2)**(y**2)', '-(x**2)**3', '2**-x',
+                         'x-(y-3)', 'x/(y/2)', '(x**y)**(1/2)'), bindings={'x': 1.5, 'y': 1.25}):
+    import math
+    import numpy
+    for formula in formulas:
+        expression = Expression.fromString(formula)
+        expected = expression.evaluate(bindings).value
+        for target, module in [('python', {'math': math}), ('numpy', {'np': numpy})]:
+            value = eval(expression.emit(target), module, dict(bindings))
+            if not math.isclose(value, expected, rel_tol=1e-12):
+                raise AssertionError('%s emitted as %s gives %r instead of %r' % (formula, target, value, expected))
+    print('emitted python and numpy source of %d formulas agrees with evaluate()' % len(formulas))
+
+# derivative_many with one process against a pool of worker processes
+def benchmark_batch(count=2000, terms=10, seed=0, workers=(1, None)):
+    rng = random.Random(seed)
+    expressions = [Expression.fromString(random_formula(rng, terms)) for i in range(count)]
+    print('differentiating %d formulas of %d terms' % (count, terms))
+    for number in workers:
+        start = time.perf_counter()
+        derivative_many(expressions, 'x', workers=number)
+        print('  %-14s %8.1f us per formula' % ('workers=%s' % number, 1e6 * (time.perf_counter() - start) / count))
+
+# round trips of expressions through str and fromString, pickle and to_bytes/from_bytes,
+# and reading the to_bytes encodings back from a memory-mapped file
+def benchmark_serialization(count=2000, terms=20, seed=0):
+    rng = random.Random(seed)
+    expressions = [Expression.fromString(random_formula(rng, terms)) for i in range(count)]
+    print('serializing %d formulas of %d terms, total size and time per formula' % (count, terms))
+    methods = [('str', str, Expression.fromString),
+               ('pickle', pickle.dumps, pickle.loads),
+               ('to_bytes', Expression.to_bytes, Expression.from_bytes)]
+    maxsize = parse_cache.maxsize
+    parse_cache.resize(0)
+    try:
+        for name, dump, load in methods:
+            start = time.perf_counter()
+            encoded = [dump(expression) for expression in expressions]
+            middle = time.perf_counter()
+            for data in encoded:
+                load(data)
+            end = time.perf_counter()
+            print('  %-14s %8d bytes, %8.1f us to write, %8.1f us to read' % (name, sum(len(data) for data in encoded),
+                  1e6 * (middle - start) / count, 1e6 * (end - middle) / count))
+    finally:
+        parse_cache.resize(maxsize)
+    with tempfile.TemporaryFile() as file:
+        offsets = []
+        for data in encoded:
+            offsets.append(file.tell())
+            file.write(data)
+        file.flush()
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        start = time.perf_counter()
+        for offset in offsets:
+            Expression.from_bytes(mapped, offset)
+        print('  %-14s %8s       %8s               %8.1f us to read' % ('mmap', '', '', 1e6 * (time.perf_counter() - start) / count))
+        mapped.close()
+
+# simplify and differentiate the same formulas in two runs sharing a ResultCache file
+def benchmark_result_cache(count=500, terms=10, seed=0):
+    rng = random.Random(seed)
+    formulas = [random_formula(rng, terms) for i in range(count)]
+    print('simplifying and differentiating %d formulas of %d terms, twice' % (count, terms))
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'results.sqlite')
+    try:
+        for run in ['cold', 'warm']:
+            Symbolische_manipulatie.result_cache = ResultCache(path)
+            start = time.perf_counter()
+            for formula in formulas:
+                expression = Expression.fromString(formula)
+                expression.simplify()
+                expression.derivative('x')
+            elapsed = time.perf_counter() - start
+            stats = Symbolische_manipulatie.result_cache.stats()
+            Symbolische_manipulatie.result_cache.close()
+            print('  %-14s %8.1f us per formula, %d hits, %d misses' % (run, 1e6 * elapsed / count, stats['hits'], stats['misses']))
+    finally:
+        Symbolische_manipulatie.result_cache = None
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+# the gradient of a product of nested powers, evaluated tree by tree and as one ExpressionDAG
+def benchmark_cse(factors=6, repeat=200):
+    variables = ['x%d' % i for i in range(factors)]
+    expression = Expression.fromString(' * '.join('(%s + sin(%s)) ** (%s + 1)' % (v, v, w)
+                                                   for v, w in zip(variables, variables[1:] + variables[:1])))
+    gradient = expression.gradient(variables)
+    dag = ExpressionDAG.fromExpressions(gradient)
+    nodes = sum(len(ExpressionDAG.fromExpression(derivative)) for derivative in gradient)
+    print('gradient of a product of %d powers: %d nodes in a DAG per derivative, %d in one DAG' % (factors, nodes, len(dag)))
+    bindings = dict((v, 0.5 + i / 10.0) for i, v in enumerate(variables))
+    arguments = [bindings[v] for v in variables]
+    functions = [derivative.compile(variables) for derivative in gradient]
+    function = dag.compile(variables)
+    for name, run in [('evaluate trees', lambda: [derivative.evaluate(bindings) for derivative in gradient]),
+                      ('evaluate DAG', lambda: dag.evaluate(bindings)),
+                      ('compiled trees', lambda: [f(*arguments) for f in functions]),
+                      ('compiled DAG', lambda: function(*arguments))]:
+        start = time.perf_counter()
+        for i in range(repeat):
+            run()
+        print('  %-14s %8.1f us per gradient' % (name, 1e6 * (time.perf_counter() - start) / repeat))
+
+# the expression service on a Unix socket: clients sending derivative requests concurrently, first
+# computed in batches, then answered from the shared response cache
+def benchmark_service(count=400, terms=8, clients=8, workers=0, seed=0):
+    import asyncio
+    from expression_service import ExpressionService, connect
+    rng = random.Random(seed)
+    formulas = [random_formula(rng, terms) for i in range(count)]
+    async def client(address, part):
+        connection = await connect(address)
+        await asyncio.gather(*[connection.request('derivative', formula, variable='x') for formula in part])
+        await connection.close()
+    async def run():
+        with tempfile.TemporaryDirectory() as directory:
+            service = ExpressionService(workers=workers)
+            address = await service.start(os.path.join(directory, 'service.sock'))
+            print('%d derivative requests from %d clients, %d workers' % (count, clients, workers))
+            for name in ['computed', 'cached']:
+                start = time.perf_counter()
+                await asyncio.gather(*[client(address, formulas[i::clients]) for i in range(clients)])
+                elapsed = time.perf_counter() - start
+                print('  %-10s %8.1f requests/s' % (name, count / elapsed))
+            metrics = service.metrics()
+            print('  %d batches of %.1f requests, latency p50 %.1f ms, p95 %.1f ms' % (metrics['batches'],
+                  metrics['mean_batch'], metrics['latency_ms']['p50'], metrics['latency_ms']['p95']))
+            await service.close()
+    asyncio.run(run())
+
+# numeric gradients of random formulas at many points: forward-mode value_and_gradient against
+# evaluating the symbolic derivatives with evaluate_batch and with compiled functions
+def benchmark_gradient(terms=60, points=10000, seed=0):
+    import numpy as np
+    rng = random.Random(seed)
+    expression = Expression.fromString(random_formula(rng, terms))
+    variables = sorted(expression.free_variables())
+    columns = dict((v, np.linspace(0.1, 1.0, points) + i) for i, v in enumerate(variables))
+    print('gradient of a random formula of %d terms in %d variables at %d points, seconds' % (terms, len(variables), points))
+    start = time.perf_counter()
+    value, dual = expression.value_and_gradient(columns, variables)
+    print('  %-26s %8.4f' % ('value_and_gradient', time.perf_counter() - start))
+    start = time.perf_counter()
+    symbolic = [derivative.evaluate_batch(columns) for derivative in expression.gradient(variables)]
+    print('  %-26s %8.4f' % ('gradient + evaluate_batch', time.perf_counter() - start))
+    start = time.perf_counter()
+    functions = [derivative.compile(variables, vectorized=True) for derivative in expression.gradient(variables)]
+    [f(*[columns[v] for v in variables]) for f in functions]
+    print('  %-26s %8.4f' % ('gradient + compile', time.perf_counter() - start))
+    with np.errstate(all='ignore'):
+        for d, s in zip(dual, symbolic):
+            assert np.allclose(d, s, equal_nan=True)
+
+# roots and integrals of sin(x) - a*x for many values of a: Newton by hand with evaluate against newton,
+# find_root and integrate on all of them at once
+def benchmark_solvers(count=200, hand=20):
+    import numpy as np
+    expression = Expression.fromString('sin(x) - a * x + 0.1')
+    derivative = expression.derivative('x')
+    slopes = np.linspace(0.05, 0.95, count)
+    print('roots and integrals of %s for %d values of a' % (expression, count))
+    start = time.perf_counter()
+    for a in slopes[:hand]:
+        x = 2.0
+        for i in range(50):
+            step = float(expression.evaluate({'x': x, 'a': a})) / float(derivative.evaluate({'x': x, 'a': a}))
+            x -= step
+            if abs(step) <= 1e-12 * (1 + abs(x)):
+                break
+    print('  %-26s %8.1f us per root' % ('Newton with evaluate', 1e6 * (time.perf_counter() - start) / hand))
+    for name, solve in [('newton', lambda: expression.newton('x', 2.0, {'a': slopes})),
+                        ('find_root', lambda: expression.find_root('x', 0.1, 2 * np.pi, {'a': slopes})),
+                        ('integrate', lambda: expression.integrate('x', 0, np.pi, {'a': slopes}))]:
+        start = time.perf_counter()
+        result = solve()
+        stats = result.stats()
+        print('  %-26s %8.1f us per point, %d of %d converged, %.1f iterations, %d evaluations' % (
+            name, 1e6 * (time.perf_counter() - start) / count, stats['converged'], stats['points'],
+            stats['iterations']['mean'], stats['evaluations']))
+
+# collecting like terms of random polynomials with expand, and with simplify up to simplify_limit terms
+def benchmark_expand(sizes=(250, 1000, 4000, 16000), simplify_limit=250, seed=0):
+    rng = random.Random(seed)
+    print('collecting terms of sums of monomials in 10 variables, seconds')
+    print('  %8s %8s %8s %8s' % ('terms', 'result', 'expand', 'simplify'))
+    for n in sizes:
+        expression = Expression.fromString(' + '.join('%d*x%d**%d*y' % (rng.randint(1, 9), rng.randint(0, 9), rng.randint(1, 3))
+                                                      for i in range(n)))
+        start = time.perf_counter()
+        expanded = expression.expand()
+        timings = [time.perf_counter() - start]
+        if n <= simplify_limit:
+            start = time.perf_counter()
+            expression.simplify()
+            timings.append(time.perf_counter() - start)
+        print('  %8d %8d %s' % (n, str(expanded).count('+') + 1, ' '.join('%8.3f' % t for t in timings)))
+
+# render formulas of one and two variables into a multi-page PDF, without a display
+def benchmark_graph(count=40, seed=0):
+    rng = random.Random(seed)
+    formulas = ['sin(%d*x) + %d*x**%d - tan(x)' % (rng.randint(1, 9), rng.randint(1, 9), rng.randint(1, 3))
+                for i in range(count - count // 4)]
+    formulas += ['x * sin(%d*y) + y**%d' % (rng.randint(1, 9), rng.randint(1, 3)) for i in range(count // 4)]
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        graph_pages(formulas, os.path.join(directory, 'graphs.pdf'), (-3, 3))
+        elapsed = time.perf_counter() - start
+    print('plotting %d formulas into one PDF: %8.1f ms per page' % (count, 1e3 * elapsed / count))
+
+# fold a long chain of constant fractions, with floats and exactly
+def benchmark_constant_folding(terms=2000):
+    expression = Expression.fromString(' + '.join('1/%d' % k for k in range(1, terms + 1)))
+    print('folding the sum of 1/k for k = 1..%d' % terms)
+    for exact in [False, True]:
+        start = time.perf_counter()
+        result = expression.simplify(exact=exact)
+        elapsed = time.perf_counter() - start
+        print('  %-14s %8.3f s, %.17g' % ('exact' if exact else 'floats', elapsed, float(result.value)))
+
+# simplify random formulas with and without profiling(), and show the rules that took the most time
+def benchmark_profiling(count=50, terms=10, seed=0, top=5):
+    rng = random.Random(seed)
+    expressions = [Expression.fromString(random_formula(rng, terms)) for i in range(count)]
+    start = time.perf_counter()
+    for expression in expressions:
+        expression.simplify()
+    plain = time.perf_counter() - start
+    with profiling() as profile:
+        for expression in expressions:
+            expression.simplify()
+    print('simplifying %d formulas: %.3f s, %.3f s while profiling' % (count, plain, profile.elapsed))
+    rules = sorted(profile.stats()['rules'].items(), key=lambda item: -item[1]['time'])
+    for name, rule in rules[:top]:
+        print('  %-32s %6d times %8.3f s  %s' % (name, rule['count'], rule['time'], rule['rule']))
+
+# modules that importing Symbolische_manipulatie must not load, they are imported on first use
+HEAVY_MODULES = ['numpy', 'matplotlib']
+
+# time a fresh interpreter importing the module, against one that only starts up;
+# fails when the import loads one of HEAVY_MODULES or takes longer than limit seconds
+def benchmark_import(runs=5, limit=0.5):
+    check = ('import sys, Symbolische_manipulatie; '
+             'print(" ".join(m for m in %r if m in sys.modules))' % HEAVY_MODULES)
+    timings = {}
+    for name, code in [('startup', 'pass'), ('import', check)]:
+        best = None
+        for i in range(runs):
+            start = time.perf_counter()
+            output = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+    print('importing Symbolische_manipulatie, best of %d' % runs)
+    print('  %-14s %8.1f ms' % ('startup', 1e3 * timings['startup']))
+    print('  %-14s %8.1f ms' % ('import', 1e3 * (timings['import'] - timings['startup'])))
+    loaded = output.split()
+    if loaded:
+        raise AssertionError('importing Symbolische_manipulatie loads %s' % ', '.join(loaded))
+    if timings['import'] - timings['startup'] > limit:
+        raise AssertionError('importing Symbolische_manipulatie takes more than %.2f s' % limit)
+
+
+# workloads of the suite: every generator makes an expression of the given size from a seeded Random
+# a product of n factors (x + k)
+def wide_product(rng, n):
+    tree = Variable('x') + Constant(rng.randint(1, 9))
+    for i in range(1, n):
+        tree = tree * (Variable('x') + Constant(rng.randint(1, 9)))
+    return tree
+
+FUNCTIONS = {'sin': SinNode, 'cos': CosNode, 'tan': TanNode}
+
+# n functions nested in each other, log only of positive arguments
+def nested_functions(rng, n):
+    tree = Variable('x')
+    for i in range(n):
+        function = rng.choice(['sin', 'cos', 'tan', 'log'])
+        if function == 'log':
+            tree = LogNode(tree ** Constant(2) + Constant(1))
+        else:
+            tree = FUNCTIONS[function](tree + Constant(rng.randint(1, 3)))
+    return tree
+
+# the sum of (x + k) ** i for i up to n
+def high_power(rng, n):
+    tree = Variable('x') + Constant(rng.randint(1, 9))
+    for i in range(2, n + 1):
+        tree = tree + (Variable('x') + Constant(rng.randint(1, 9))) ** Constant(i)
+    return tree
+
+# a formula string of n random terms, parsed
+def long_formula(rng, n):
+    return Expression.fromString(random_formula(rng, n))
+
+# a left-deep sum of n distinct variables x0 + x1 + ..., in which no two terms combine;
+# simplify and derivative have to handle it without recursion and in about linear time
+def distinct_sum(rng, n):
+    return deep_sum(n, variables=n)
+
+SUITE_WORKLOADS = [('deep_sum', lambda rng, n: deep_sum(n), (100, 1000, 10000, 100000)),
+                   ('wide_product', wide_product, (10, 100, 1000, 10000)),
+                   ('nested_functions', nested_functions, (10, 50, 250, 1000)),
+                   ('high_power', high_power, (10, 100, 1000)),
+                   ('long_formula', long_formula, (10, 100, 1000, 10000)),
+                   ('distinct_sum', distinct_sum, (100, 1000, 10000))]
+
+# the operations of the suite on an expression, given the formula string of the expression
+def _suite_operations(expression, formula):
+    variables = sorted(expression.free_variables())
+    bindings = dict((name, 0.5 + i / 10.0) for i, name in enumerate(variables))
+    def parse():
+        maxsize = parse_cache.maxsize
+        parse_cache.resize(0)
+        try:
+            Expression.fromString(formula)
+        finally:
+            parse_cache.resize(maxsize)
+    operations = [('parse', parse),
+                  ('simplify', lambda: expression.simplify()),
+                  ('derivative', lambda: expression.derivative(variables[0])),
+                  ('evaluate', lambda: expression.evaluate(bindings))]
+    if len(variables) <= 2:
+        operations.append(('graph', lambda: graph(expression, (0.5, 1.5), filename=None, show=False)))
+    return operations
+
+# run every operation on every workload for increasing sizes; reports the best time of repeat runs and the peak
+# memory (traced in a separate run). Once an operation takes longer than budget seconds on a workload, it is
+# skipped for the larger sizes. Returns the results as a dictionary, and writes them as JSON to output.
+def benchmark_suite(output=None, seed=0, repeat=3, budget=2.0, workloads=None):
+    results = []
+    print('%-18s %8s %-12s %10s %10s' % ('workload', 'size', 'operation', 'seconds', 'peak KB'))
+    for workload, generate, sizes in workloads or SUITE_WORKLOADS:
+        too_slow = set()
+        for size in sizes:
+            expression = generate(random.Random('%s-%d-%d' % (workload, size, seed)), size)
+            formula = str(expression)
+            for operation, run in _suite_operations(expression, formula):
+                if operation in too_slow:
+                    continue
+                try:
+                    timings = []
+                    for i in range(repeat):
+                        start = time.perf_counter()
+                        run()
+                        timings.append(time.perf_counter() - start)
+                        if timings[-1] > budget:
+                            break
+                    tracemalloc.start()
+                    run()
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                except (ImportError, RecursionError, ArithmeticError, ValueError) as error:
+                    if tracemalloc.is_tracing():
+                        tracemalloc.stop()
+                    print('%-18s %8d %-12s %s' % (workload, size, operation, type(error).__name__))
+                    too_slow.add(operation)
+                    continue
+                if min(timings) > budget:
+                    too_slow.add(operation)
+                results.append({'workload': workload, 'size': size, 'operation': operation,
+                                'time': min(timings), 'peak': peak})
+                print('%-18s %8d %-12s %10.4f %10.1f' % (workload, size, operation, min(timings), peak / 1e3))
+    report = {'seed': seed, 'repeat': repeat, 'python': platform.python_version(),
+              'platform': platform.platform(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}
+    if output is not None:
+        with open(output, 'w') as file:
+            json.dump(report, file, indent=1)
+    return report
+
+# compare two result files of benchmark_suite, flagging operations that got slower (or used more memory)
+# than threshold times the old result; returns the number of regressions. An operation only counts as
+# slower when it also takes minimum seconds longer, timings of a fraction of a millisecond are mostly noise
+def compare_suites(old_path, new_path, threshold=1.2, minimum=0.001):
+    with open(old_path) as file:
+        old = dict(((r['workload'], r['size'], r['operation']), r) for r in json.load(file)['results'])
+    with open(new_path) as file:
+        new = json.load(file)['results']
+    regressions = 0
+    print('%-18s %8s %-12s %10s %10s %8s %8s' % ('workload', 'size', 'operation', 'old s', 'new s', 'time', 'memory'))
+    for result in new:
+        before = old.get((result['workload'], result['size'], result['operation']))
+        if before is None:
+            continue
+        time_ratio = result['time'] / max(before['time'], 1e-9)
+        memory_ratio = result['peak'] / float(max(before['peak'], 1))
+        slower = time_ratio > threshold and result['time'] - before['time'] > minimum
+        flag = ''
+        if slower or memory_ratio > threshold:
+            flag = '  slower' if slower else '  more memory'
+            regressions += 1
+        print('%-18s %8d %-12s %10.4f %10.4f %7.2fx %7.2fx%s' % (result['workload'], result['size'], result['operation'],
+              before['time'], result['time'], time_ratio, memory_ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmarks for Symbolische_manipulatie; without a command all benchmarks run.')
+    commands = parser.add_subparsers(dest='command')
+    suite = commands.add_parser('suite', help='run the seeded benchmark suite')
+    suite.add_argument('--output', help='write the results as JSON to this file')
+    suite.add_argument('--seed', type=int, default=0)
+    suite.add_argument('--repeat', type=int, default=3)
+    suite.add_argument('--budget', type=float, default=2.0, help='skip larger sizes of an operation slower than this (seconds)')
+    compare = commands.add_parser('compare', help='compare two result files of the suite')
+    compare.add_argument('old')
+    compare.add_argument('new')
+    compare.add_argument('--threshold', type=float, default=1.2)
+    compare.add_argument('--minimum', type=float, default=0.001, help='ignore slowdowns of less than this (seconds)')
+    options = parser.parse_args(argv)
+    if options.command == 'suite':
+        benchmark_suite(options.output, options.seed, options.repeat, options.budget)
+    elif options.command == 'compare':
+        return 1 if compare_suites(options.old, options.new, options.threshold, options.minimum) else 0
+    else:
+        run_all()
+    return 0
+
+def run_all():
+    benchmark_import()
+    benchmark_parser()
+    benchmark_parse_cache()
+    benchmark_depth()
+    benchmark_memory()
+    check_emit()
+    benchmark_emit()
+    benchmark_batch()
+    benchmark_service()
+    benchmark_serialization()
+    benchmark_result_cache()
+    benchmark_cse()
+    benchmark_gradient()
+    benchmark_solvers()
+    benchmark_expand()
+    benchmark_graph()
+    benchmark_constant_folding()
+    benchmark_profiling()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,368 @@
+#a local server around Symbolische_manipulatie: other programs send formulas to parse, simplify, differentiate
+#or evaluate, and share one warmed-up set of caches instead of importing the module themselves. Start it with
+#    python expression_service.py --unix /tmp/expressions.sock --workers 4 --cache results.db
+#or on localhost TCP with --port 8765. The protocol is one JSON object per line in both directions:
+#    {"id": 1, "op": "derivative", "formula": "x**2*sin(x)", "variable": "x"}
+#    {"id": 1, "result": "2 * x * sin(x) + x ** 2 * cos(x)"}
+#op is parse, simplify, derivative (with "variable"), evaluate (with "bindings", e.g. {"x": 2}) or metrics;
+#"exact": true computes with fractions and "target" picks the text of the result (see Expression.emit).
+#A failing request gets {"id": 1, "error": {"type": "ValueError", "message": "..."}}.
+#From Python, use a Client:
+#    client = await connect('/tmp/expressions.sock')
+#    await client.request('simplify', 'x + x')
+
+import asyncio
+import collections
+import json
+import os
+import sys
+import time
+import types
+
+import Symbolische_manipulatie
+from Symbolische_manipulatie import LRUCache, ResultCache
+
+OPERATIONS = ('parse', 'simplify', 'derivative', 'evaluate')
+
+# the longest line (request or response) the service and the client accept
+LINE_LIMIT = 1 << 26
+
+
+class ServiceError(Exception):
+    """A request that failed in the expression service, raised by Client.request"""
+    def __init__(self, error_type, message):
+        Exception.__init__(self, '%s: %s' % (error_type, message))
+        self.error_type = error_type
+        self.message = message
+
+
+# the canonical form of a request, used as the key of coalescing and of the response cache;
+# raises ValueError for a request the service doesn't understand
+def _request_key(request):
+    operation = request.get('op', 'parse')
+    if operation not in OPERATIONS:
+        raise ValueError('Unknown operation %s, expected one of %s' % (operation, ', '.join(OPERATIONS)))
+    if not isinstance(request.get('formula'), str):
+        raise ValueError('A request needs a formula string')
+    variable = request.get('variable') if operation == 'derivative' else None
+    if operation == 'derivative' and not isinstance(variable, str):
+        raise ValueError('A derivative request needs a variable')
+    bindings = (request.get('bindings') or {}) if operation == 'evaluate' else {}
+    # a string or list would be computed with as well: {"x": "2"} makes x*3 into "222"
+    if not isinstance(bindings, dict) or not all(isinstance(value, (int, float)) and not isinstance(value, bool)
+                                                 for value in bindings.values()):
+        raise ValueError('bindings must map variable names onto numbers')
+    return json.dumps([operation, request['formula'], variable, sorted(bindings.items()),
+                       bool(request.get('exact', False)), request.get('target', 'infix')])
+
+# the work of a worker: compute the requests of a batch (given by their keys) with the pipeline of the
+# command line tool, returns for each one ['result', text] or ['error', type, message]
+def _run_batch(keys):
+    results = []
+    for key in keys:
+        operation, formula, variable, bindings, exact, target = json.loads(key)
+        options = types.SimpleNamespace(simplify=operation == 'simplify', derivative=variable,
+                                        evaluate=operation == 'evaluate', bindings=dict(bindings), exact=exact)
+        try:
+            results.append(['result', Symbolische_manipulatie._process(formula, options).emit(target)])
+        except Exception as error:
+            results.append(['error', type(error).__name__, str(error)])
+    return results
+
+# set up a worker process: all workers share the persistent result cache, if there is one
+def _init_worker(cache):
+    if cache is not None:
+        Symbolische_manipulatie.result_cache = ResultCache(cache)
+
+
+class ExpressionService():
+    """The asyncio server: coalesces concurrent requests into batches and computes them in a worker pool"""
+    # workers=0 computes in a thread of this process, otherwise in that many worker processes.
+    # A batch is sent off once it holds batch_size requests or batch_delay seconds after its first request;
+    # responses keeps the results of that many recent requests, shared by all clients
+    def __init__(self, workers=0, cache=None, batch_size=64, batch_delay=0.002, responses=4096):
+        self.workers = workers
+        self.cache = cache
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.responses = LRUCache(responses)
+        # key -> future of a request that is queued or being computed, later identical requests wait for it
+        self.pending = {}
+        self.queue = None
+        self.executor = None
+        self.server = None
+        self.tasks = []
+        self.requests = 0
+        self.errors = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.batched = 0
+        self.latencies = collections.deque(maxlen=10000)
+        self.started = None
+        self.previous_cache = None
+
+    # start listening on the Unix socket path, or else on host and port (port 0 picks a free one);
+    # returns the address: the path, or (host, port)
+    async def start(self, path=None, host='127.0.0.1', port=0):
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        loop = asyncio.get_running_loop()
+        if self.workers <= 0:
+            self.previous_cache = Symbolische_manipulatie.result_cache
+            _init_worker(self.cache)
+            self.executor = ThreadPoolExecutor(1)
+        else:
+            self.executor = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self.cache,))
+            # pay for starting the workers and importing the module now, not on the first requests
+            await asyncio.gather(*[loop.run_in_executor(self.executor, _run_batch, [])
+                                   for i in range(self.workers)])
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(max(self.workers, 1))
+        self.tasks.append(asyncio.ensure_future(self._batcher()))
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self._connection, path, limit=LINE_LIMIT)
+            address = path
+        else:
+            self.server = await asyncio.start_server(self._connection, host, port, limit=LINE_LIMIT)
+            address = self.server.sockets[0].getsockname()[:2]
+        self.started = time.perf_counter()
+        return address
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.executor is not None:
+            self.executor.shutdown()
+        if self.workers <= 0 and self.cache is not None:
+            Symbolische_manipulatie.result_cache.close()
+            Symbolische_manipulatie.result_cache = self.previous_cache
+
+    # the response to one request (a dictionary), also usable directly without a connection
+    async def submit(self, request):
+        start = time.perf_counter()
+        self.requests += 1
+        response = {'id': request.get('id')}
+        try:
+            if request.get('op') == 'metrics':
+                response['result'] = self.metrics()
+                return response
+            key = _request_key(request)
+        except (ValueError, TypeError) as error:
+            self.errors += 1
+            response['error'] = {'type': type(error).__name__, 'message': str(error)}
+            return response
+        result = self.responses.get(key)
+        if result is None:
+            future = self.pending.get(key)
+            if future is None:
+                future = self.pending[key] = asyncio.get_running_loop().create_future()
+                self.queue.put_nowait((key, future))
+            else:
+                self.coalesced += 1
+            result = await future
+        if result[0] == 'result':
+            response['result'] = result[1]
+        else:
+            self.errors += 1
+            response['error'] = {'type': result[1], 'message': result[2]}
+        self.latencies.append(time.perf_counter() - start)
+        return response
+
+    # collect queued requests into batches, and start a batch whenever a worker is free
+    async def _batcher(self):
+        while True:
+            batch = [await self.queue.get()]
+            deadline = asyncio.get_running_loop().time() + self.batch_delay
+            while len(batch) < self.batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self.slots.acquire()
+            self.tasks.append(asyncio.ensure_future(self._compute(batch)))
+            self.tasks = [task for task in self.tasks if not task.done()]
+
+    async def _compute(self, batch):
+        try:
+            self.batches += 1
+            self.batched += len(batch)
+            try:
+                results = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, _run_batch, [key for key, future in batch])
+            except Exception as error:
+                # the pool itself failed (e.g. a worker process died), every request of the batch fails
+                results = [['error', type(error).__name__, str(error)]] * len(batch)
+            for (key, future), result in zip(batch, results):
+                if result[0] == 'result':
+                    self.responses.put(key, result)
+                del self.pending[key]
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self.slots.release()
+
+    async def _connection(self, reader, writer):
+        replies = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    # a line over LINE_LIMIT, or the client went away
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('A request must be a JSON object')
+                except ValueError as error:
+                    self.requests += 1
+                    self.errors += 1
+                    self._write(writer, {'id': None, 'error': {'type': 'ValueError', 'message': str(error)}})
+                    continue
+                # requests of one connection are answered as soon as they are done, not in order
+                reply = asyncio.ensure_future(self._reply(writer, request))
+                replies.add(reply)
+                reply.add_done_callback(replies.discard)
+            if replies:
+                await asyncio.gather(*replies, return_exceptions=True)
+        finally:
+            writer.close()
+
+    async def _reply(self, writer, request):
+        self._write(writer, await self.submit(request))
+        await writer.drain()
+
+    def _write(self, writer, response):
+        if not writer.is_closing():
+            writer.write(json.dumps(response).encode('utf-8') + b'\n')
+
+    # counts, latency (in milliseconds, over the last 10000 requests) and throughput since the start
+    def metrics(self):
+        latencies = sorted(self.latencies)
+        def percentile(p):
+            if not latencies:
+                return None
+            return 1e3 * latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+        uptime = time.perf_counter() - self.started if self.started is not None else 0.0
+        metrics = {'requests': self.requests, 'errors': self.errors, 'coalesced': self.coalesced,
+                   'batches': self.batches, 'mean_batch': self.batched / float(self.batches) if self.batches else None,
+                   'queued': self.queue.qsize() if self.queue is not None else 0, 'pending': len(self.pending),
+                   'latency_ms': {'p50': percentile(0.5), 'p95': percentile(0.95), 'p99': percentile(0.99),
+                                  'max': 1e3 * latencies[-1] if latencies else None},
+                   'uptime': uptime, 'throughput': self.requests / uptime if uptime else None,
+                   'workers': self.workers, 'responses': self.responses.stats()}
+        if self.workers <= 0:
+            # the caches of the module are only those of this process when it computes itself
+            metrics['parse_cache'] = Symbolische_manipulatie.parse_cache.stats()
+            if Symbolische_manipulatie.result_cache is not None:
+                metrics['result_cache'] = Symbolische_manipulatie.result_cache.stats()
+        return metrics
+
+
+# start an ExpressionService and serve until cancelled
+async def serve(path=None, host='127.0.0.1', port=8765, workers=0, cache=None, batch_size=64, batch_delay=0.002):
+    service = ExpressionService(workers, cache, batch_size, batch_delay)
+    address = await service.start(path, host, port)
+    sys.stderr.write('expression service listening on %s\n' % (address if path else '%s:%d' % address))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await service.close()
+
+
+class Client():
+    """A connection to an ExpressionService, made by connect; requests may be sent concurrently"""
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.waiting = {}
+        self.next_id = 0
+        self.receiver = asyncio.ensure_future(self._receive())
+
+    # the result text of a request, e.g. await client.request('derivative', 'x**2', variable='x');
+    # raises ServiceError when the request failed
+    async def request(self, op, formula=None, **fields):
+        response = await self.send(dict(fields, op=op, formula=formula))
+        if 'error' in response:
+            raise ServiceError(response['error']['type'], response['error']['message'])
+        return response['result']
+
+    async def metrics(self):
+        return (await self.send({'op': 'metrics'}))['result']
+
+    # send a request dictionary and return the response dictionary
+    async def send(self, request):
+        self.next_id += 1
+        request = dict(request, id=self.next_id)
+        future = self.waiting[self.next_id] = asyncio.get_running_loop().create_future()
+        self.writer.write(json.dumps(request).encode('utf-8') + b'\n')
+        await self.writer.drain()
+        return await future
+
+    async def _receive(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self.waiting.pop(response.get('id'), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        finally:
+            for future in self.waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('the expression service closed the connection'))
+            self.waiting.clear()
+
+    async def close(self):
+        self.writer.close()
+        await asyncio.gather(self.receiver, return_exceptions=True)
+
+# connect to the service on the Unix socket path, or else on host and port
+async def connect(path=None, host='127.0.0.1', port=8765):
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path, limit=LINE_LIMIT)
+    else:
+        reader, writer = await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+    return Client(reader, writer)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve parse, simplify, derivative and evaluate requests as JSON lines.')
+    parser.add_argument('--unix', metavar='PATH', help='listen on this Unix socket instead of TCP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('-w', '--workers', type=int, default=0,
+                        help='number of worker processes, 0 computes in a thread of the server (default)')
+    parser.add_argument('-c', '--cache', metavar='FILE', help='share simplify and derivative results in FILE')
+    parser.add_argument('--batch-size', type=int, default=64, help='most requests in one batch')
+    parser.add_argument('--batch-delay', type=float, default=2.0,
+                        help='milliseconds to wait for more requests before sending off a batch')
+    options = parser.parse_args(argv)
+    if options.unix is not None and os.path.exists(options.unix):
+        os.unlink(options.unix)
+    try:
+        asyncio.run(serve(options.unix, options.host, options.port, options.workers, options.cache,
+                          options.batch_size, options.batch_delay / 1e3))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())